@@ -1,59 +1,197 @@
 from asyncio import Lock
+from pathlib import Path
+import argparse
+import copy
+import io
 import json
 import os
-import shelve
+import subprocess
+import sys
 
+from discord import File, Intents, MemberCacheFlags
 from discord.ext import commands as cmds
 
 from cogs.rpg import RPG
 from cogs.other import Other
+from cogs.modules.emoji import EmojiSync
+from cogs.modules.misc import Timer
+from cogs.modules.presets import PresetGraph
+from cogs.modules.memory import memory_report
+from cogs.modules.metrics import Metrics
+from cogs.modules.limits import limiter, RateLimited, Coalesced
+from cogs.modules.profiling import profile as profile_run
+from cogs.modules.configs import store, cluster
+from cogs.modules.configs import memory_config as mcon
+from cogs.modules.configs import metrics_config as metcon
 
-puck = cmds.Bot(command_prefix = "!")
+def _budget_options():
+	"""Options that keep only what the cogs use, for fitting more guilds in memory"""
+	# guilds for channels, emojis for the emoji index, messages for commands,
+	# and reactions for paging. no members or presences are ever sent
+	intents = Intents.none()
+	intents.guilds = True
+	intents.emojis = True
+	intents.guild_messages = intents.dm_messages = True
+	intents.guild_reactions = intents.dm_reactions = True
+	return {
+		"intents": intents,
+		# commands never look back at old messages, so this can be off entirely
+		"max_messages": mcon["messages"] or None,
+		# members are looked up when needed, and remembered by the RPG cog
+		"member_cache_flags": MemberCacheFlags.none(),
+		"chunk_guilds_at_startup": False
+	}
+
+def _full_options():
+	"""Options that cache whatever the bot is sent, as it did before discord had intents"""
+	intents = Intents.default()
+	# a privileged intent, which has to be turned on for the bot in discord's developer portal,
+	# so it's only asked for if configured. without it x-cards look members up, a few at a time
+	intents.members = mcon["members_intent"]
+	return {"intents": intents}
+
+# connects however many shards it's given, or as many as discord recommends
+puck = cmds.AutoShardedBot(command_prefix = "!", **(_budget_options() if mcon["budget"] else _full_options()))
 puck.add_cog(Other())
 puck.add_cog(RPG())
 puck.help_command.cog = puck.cogs["Other"]
+emoji_sync = EmojiSync()
+metrics = Metrics(cluster, **metcon.load())
+# commands are timed from their first check, so it has to come before the rest
+puck.check_once(metrics.check)
+# every command is charged against its user's, channel's and guild's rate limits
+puck.check_once(limiter.check)
+_cleared = False
 
 @puck.command(aliases=["stop", "exit"], hidden=True)
 @cmds.is_owner()
 async def quit(ctx):
 	await puck.close()
 
+@puck.command(hidden=True)
+@cmds.is_owner()
+async def profile(ctx, *, line: str):
+	"""Run a command line once under the profiler, e.g. "!profile roll 8d10x >= 7" """
+	message = copy.copy(ctx.message)
+	message.content = ctx.prefix + line
+	inner = await puck.get_context(message)
+	if inner.command is None:
+		await ctx.send(f"No such command: \"{line}\"")
+		return
+
+	# rolls are made in this process, not the offloader's workers, which the profiler can't see
+	inner.profiling = True
+	report = await profile_run(lambda: inner.command.invoke(inner))
+	# the whole report rarely fits in a message, so it's attached as well
+	await ctx.send(
+		f"```\n{report[:1900]}\n```",
+		file = File(io.BytesIO(report.encode()), "profile.txt")
+	)
+
+@puck.command(hidden=True)
+@cmds.is_owner()
+async def memory(ctx):
+	rpg = puck.get_cog("RPG")
+	await ctx.send(f"```\n{memory_report(puck, rpg and rpg.members)}\n```")
+
 @puck.event
 async def on_ready():
-	# read the emoji config
-	with open("./configs/emoji.json", "r") as file:
-		emojis = json.load(file)
-
 	# upload any required emoji not already existing
-	for guild in puck.guilds:
-		for path, name in emojis.items():
-			if any(e.name == name for e in guild.emojis): continue
-			with open(path, "rb") as file:
-				try:
-					print("Uploading emoji:", name)
-					await guild.create_custom_emoji(
-						name=name,
-						image=file.read(),
-						reason="required emoji"
-					)
-				except BaseException as e:
-					print(e)
+	await emoji_sync.sync(puck.guilds)
 	print("Done updating emoji")
+	print(memory_report(puck))
+
+	# forget this process's timers from before a reboot, leaving other processes' running
+	# on_ready also fires after reconnecting, when the timers are still live
+	global _cleared
+	if not _cleared:
+		Timer.clear(puck.shard_ids or range(puck.shard_count or 1))
+		# and start the RPG cog's background work
+		puck.get_cog("RPG").start(puck)
+		_cleared = True
+
+@puck.before_invoke
+async def converted(ctx):
+	metrics.converted(ctx)
+
+@puck.event
+async def on_command_completion(ctx):
+	metrics.finished(ctx)
+	limiter.finished(ctx)
+
+@puck.event
+async def on_command_error(ctx, error):
+	metrics.finished(ctx, error)
+	limiter.finished(ctx)
+	if isinstance(error, Coalesced):
+		# the identical command's reply answers this one
+		return
+	if isinstance(error, RateLimited):
+		if limiter.should_warn(ctx, error):
+			await ctx.send(str(error))
+		return
+	# then report it as the library would have
+	await cmds.AutoShardedBot.on_command_error(puck, ctx, error)
+
+@puck.event
+async def on_guild_join(guild):
+	await emoji_sync.sync([guild])
+
+@puck.event
+async def on_guild_emojis_update(guild, before, after):
+	# check this guild again on the next sync, in case a required emoji was removed
+	emoji_sync.forget(guild)
+
+def import_data():
+	"""Copy the data files from before the store into it"""
+	store.import_shelf("presets", Path("data/presets.shelf"))
+	store.import_shelf("sw", Path("data/sw.shelf"))
+	store.import_json("xcard", Path("data/xcard.json"))
+	PresetGraph.migrate()
+
+def launch(shards: int, clusters: int):
+	"""Run the bot as one process per cluster, each connecting its share of the shards"""
+	children = []
+	for i in range(clusters):
+		env = dict(os.environ, PUCK_CLUSTER = str(i), PUCK_CLUSTERS = str(clusters))
+		args = [sys.executable, __file__, "--shards", str(shards), "--clusters", str(clusters)]
+		children.append(subprocess.Popen(args, env = env))
+	for child in children:
+		child.wait()
+
+# worker processes may import this file, and must not start another bot
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--shards", type = int, default = None, help = "total shards, or discord's recommendation if not given")
+	parser.add_argument("--clusters", type = int, default = 1, help = "processes to split the shards between")
+	args = parser.parse_args()
+
+	# change the working directory to the bot root directory
+	os.chdir(os.path.dirname(__file__) or ".")
+
+	# only the parent process, or the only process, starts the children
+	if "PUCK_CLUSTER" not in os.environ:
+		import_data()
+		if args.clusters > 1:
+			if args.shards is None or args.shards < args.clusters:
+				parser.error("--shards must be given, and at least as many as --clusters")
+			launch(args.shards, args.clusters)
+			sys.exit()
+
+	if args.shards is not None:
+		puck.shard_count = args.shards
+		# each cluster takes every "clusters"-th shard
+		index = int(cluster)
+		puck.shard_ids = [s for s in range(args.shards) if s % args.clusters == index]
 
-	# clear the timers data file on reboot
-	if os.path.isfile("data/timers.shelf"):
-		os.remove("data/timers.shelf")
-
-# change the working directory to the bot root directory
-os.chdir(os.path.dirname(__file__) or ".")
-
-# get the token from the config file
-try:
-	with open("configs/token.txt", "r") as file:
-		token = file.readline()
-# if no token has been set, tell the user
-except:
-	print("Please create the file \"configs/token.txt\", and place the bot token within it.")
-# if the token is gathered successfully, run the bot
-else:
-	puck.run(token)
+	# get the token from the config file
+	try:
+		with open("configs/token.txt", "r") as file:
+			token = file.readline()
+	# if no token has been set, tell the user
+	except:
+		print("Please create the file \"configs/token.txt\", and place the bot token within it.")
+	# if the token is gathered successfully, run the bot
+	else:
+		metrics.start(puck.loop)
+		puck.run(token)
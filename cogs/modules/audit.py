@@ -0,0 +1,217 @@
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+import asyncio
+import json
+import os
+import struct
+import time
+
+class RollRecord(NamedTuple):
+	"""One roll as it was made, with everything needed to replay it"""
+	id: int
+	time: float
+	user: int
+	channel: int
+	seed: int
+	# how many times the roll was made, for batches
+	count: int
+	# (name, raw, args, subname) for each token
+	tokens: list
+	# the totals of each roll
+	results: list
+
+class RollLog:
+	"""
+	An append-only log of every roll made, kept as segment files of binary
+	records. Records are buffered in memory and written as a group, by a
+	single writer thread, either once enough have built up or a little while
+	after the first one, so making a roll never waits on the disk.
+
+	Each cluster of the bot writes its own directory of segments, and takes
+	ids in blocks from a counter in the shared store, so ids never clash.
+	"""
+	# each record is this header, then a JSON payload of its tokens and results
+	_header = struct.Struct("<QdQQQII")
+
+	# how many ids to take from the store at once
+	_block = 1000
+
+	def __init__(
+			self,
+			store,
+			cluster: str = "0",
+			path: Path = Path("./data/rolls"),
+			segment_bytes: int = 8 << 20,
+			segment_age: float = 86400.0,
+			commit_bytes: int = 64 << 10,
+			commit_interval: float = 1.0
+		):
+		"""
+		store: the Store ids are taken from
+		cluster: the name of this process's subdirectory
+		path: the directory segment files are kept in, one subdirectory per cluster
+		segment_bytes, segment_age: start a new segment once the current one is this big, or this many seconds old
+		commit_bytes, commit_interval: write buffered records once there's this many bytes of them, or this many seconds after the first
+		"""
+		self._store = store
+		self._root = path
+		self._path = path / cluster
+		self._segment_bytes = segment_bytes
+		self._segment_age = segment_age
+		self._commit_bytes = commit_bytes
+		self._commit_interval = commit_interval
+		self._buffer = []
+		self._buffered = 0
+		self._timer = None
+		# only one thread ever touches the files, so groups are written in order
+		self._writer = ThreadPoolExecutor(max_workers = 1)
+		# the open segment, and when its first record was made
+		self._file = None
+		self._started = None
+
+		self._path.mkdir(parents = True, exist_ok = True)
+		last = self._recover()
+		# logs from before the store existed, or from other clusters, may be further on
+		for directory in self._directories():
+			if directory != self._path:
+				last = max(last, self._last(directory))
+		self._floor = last + 1
+		self._next = self._end = 0
+
+	def _directories(self):
+		"""Get every directory that may hold segments, including the top one"""
+		return [self._root] + [p for p in self._root.iterdir() if p.is_dir()]
+
+	def _segments(self, directory: Path = None):
+		"""Get the first id in each segment of a directory, and its path, in order"""
+		directory = self._path if directory is None else directory
+		segments = sorted((int(p.stem), p) for p in directory.glob("*.log") if p.stem.isdigit())
+		return [i for i, _ in segments], [p for _, p in segments]
+
+	def _records(self, data: bytes):
+		"""Yield the offset of each complete record in a segment, with its header"""
+		offset = 0
+		size = self._header.size
+		while offset + size <= len(data):
+			header = self._header.unpack_from(data, offset)
+			if offset + size + header[-1] > len(data):
+				break
+			yield offset, header
+			offset += size + header[-1]
+
+	def _last(self, directory: Path):
+		"""Get the last id logged in a directory, without changing anything"""
+		firsts, paths = self._segments(directory)
+		if not paths:
+			return 0
+		last = firsts[-1] - 1
+		for _, header in self._records(paths[-1].read_bytes()):
+			last = header[0]
+		return last
+
+	def _recover(self):
+		"""Get the last id logged, trimming any record cut off by a crash"""
+		firsts, paths = self._segments()
+		if not paths:
+			return 0
+
+		data = paths[-1].read_bytes()
+		last, end = firsts[-1] - 1, 0
+		for offset, header in self._records(data):
+			if end == 0:
+				self._started = header[1]
+			last = header[0]
+			end = offset + self._header.size + header[-1]
+		if self._started is None:
+			self._started = time.time()
+		if end < len(data):
+			with open(paths[-1], "r+b") as file:
+				file.truncate(end)
+
+		self._file = open(paths[-1], "ab")
+		return last
+
+	def append(self, user: int, channel: int, seed: int, count: int, tokens, results):
+		"""Log a roll, returning its id. This only buffers the record"""
+		if self._next == self._end:
+			self._next = self._store.reserve("roll ids", self._block, floor = self._floor)
+			self._end = self._next + self._block
+		rid = self._next
+		self._next += 1
+		payload = json.dumps([
+			[(t.name, t.raw, t.args, t.subname) for t in tokens],
+			results
+		], separators = (",", ":")).encode()
+		header = self._header.pack(rid, time.time(), user, channel, seed, count, len(payload))
+		self._buffer.append(header + payload)
+		self._buffered += len(header) + len(payload)
+
+		if self._buffered >= self._commit_bytes:
+			self.commit()
+		elif self._timer is None:
+			self._timer = asyncio.get_event_loop().call_later(self._commit_interval, self.commit)
+		return rid
+
+	def commit(self):
+		"""Hand every buffered record to the writer thread as one group"""
+		if self._timer is not None:
+			self._timer.cancel()
+			self._timer = None
+		if not self._buffer:
+			return None
+
+		group = b"".join(self._buffer)
+		first = self._header.unpack_from(self._buffer[0])[0]
+		self._buffer = []
+		self._buffered = 0
+		return self._writer.submit(self._write, group, first)
+
+	def _write(self, group: bytes, first: int):
+		now = time.time()
+		if self._file is not None and (
+			self._file.tell() >= self._segment_bytes
+			or now - self._started >= self._segment_age
+		):
+			self._file.close()
+			self._file = None
+
+		if self._file is None:
+			self._file = open(self._path / f"{first:012d}.log", "ab")
+			self._started = now
+
+		self._file.write(group)
+		self._file.flush()
+		os.fsync(self._file.fileno())
+
+	def _find(self, rid: int):
+		# ids only go up within one directory, but any cluster could have made the roll
+		for directory in self._directories():
+			firsts, paths = self._segments(directory)
+			index = bisect_right(firsts, rid) - 1
+			if index < 0:
+				continue
+
+			data = paths[index].read_bytes()
+			for offset, header in self._records(data):
+				if header[0] == rid:
+					start = offset + self._header.size
+					tokens, results = json.loads(data[start:start + header[-1]])
+					return RollRecord(*header[:-1], tokens, results)
+		return None
+
+	async def find(self, rid: int):
+		"""Get a logged roll by id, or None if there's no such roll"""
+		# anything still buffered is written first, since the writer runs in order
+		self.commit()
+		loop = asyncio.get_event_loop()
+		return await loop.run_in_executor(self._writer, self._find, rid)
+
+	def close(self):
+		"""Write anything buffered, and wait for it to finish"""
+		self.commit()
+		self._writer.shutdown(wait = True)
+		if self._file is not None:
+			self._file.close()
+			self._file = None
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+class CardRelay:
+	"""
+	Passes x- and o-cards between the bot's processes through the store.
+	Each process only sees its own guilds, so a card is announced in those
+	straight away, and queued for every other process to announce in theirs.
+	Each process polls the queue, and cards are dropped once they're old.
+	"""
+	def __init__(self, store, cluster: str, namespace: str = "cards", interval: float = 1.0, keep: float = 300.0):
+		"""
+		interval: how many seconds apart the queue is checked
+		keep: how many seconds a card stays queued, which must be longer than any process is busy for
+		"""
+		self._store = store
+		self._cluster = cluster
+		self._namespace = namespace
+		self._interval = interval
+		self._keep = keep
+		# the queued cards already handled by this process, and when it started.
+		# anything queued before then is old news
+		self._seen = set()
+		self._started = time.time()
+		self._version = None
+		self._pruned = time.time()
+
+	def post(self, card: str, tag: str, uid: int):
+		"""Queue a card for the other processes"""
+		cid = self._store.reserve(self._namespace, 1)
+		with self._store.open(self._namespace) as shelf:
+			shelf[f"{cid:012d}"] = (self._cluster, time.time(), card, tag, uid)
+
+	def _prune(self, now):
+		"""Drop every card older than "keep" seconds, from any process"""
+		self._pruned = now
+		shelf = self._store.open(self._namespace)
+		old = [key for key, card in shelf.get_many(list(shelf)).items() if card[1] < now - self._keep]
+		if old:
+			with self._store.open(self._namespace) as shelf:
+				for key in old:
+					if key in shelf:
+						del shelf[key]
+
+	def _poll(self):
+		"""Get the cards queued by other processes since the last poll"""
+		now = time.time()
+		if now - self._pruned > self._keep:
+			self._prune(now)
+
+		version = self._store.version(self._namespace)
+		if version == self._version:
+			return []
+		self._version = version
+
+		shelf = self._store.open(self._namespace)
+		keys = set(shelf)
+		new = sorted(keys - self._seen)
+		self._seen = keys
+		if not new:
+			return []
+		cards = shelf.get_many(new).items()
+		return [card for _, card in sorted(cards) if card[0] != self._cluster and card[1] >= self._started]
+
+	async def run(self, deliver):
+		"""Poll for cards forever, calling deliver(card, tag, uid) for each"""
+		while True:
+			try:
+				for _, _, card, tag, uid in self._poll():
+					await deliver(card, tag, uid)
+			except Exception as e:
+				print("Could not relay cards:", repr(e))
+			await asyncio.sleep(self._interval)
@@ -1,37 +1,36 @@
 from pathlib import Path
-import json
 import os
 
+from puckdice.config import Reader as _Reader
+# shared with the dice engine, so the config is only compiled once
+from puckdice.config import dice_model
+from .store import Store, StoreView
+
 _paths = {
 	"dice": Path("./configs/dice.json"),
 	"emoji": Path("./configs/emoji.json"),
 	"colors": Path("./configs/colors.json"),
-	"rolls": Path("./configs/rolls.json")
+	"rolls": Path("./configs/rolls.json"),
+	"memory": Path("./configs/memory.json"),
+	"metrics": Path("./configs/metrics.json"),
+	"limits": Path("./configs/limits.json"),
+	"xcard": Path("./data/xcard.json"),
+	"store": Path("./data/store.sqlite3")
 }
 
-class _Reader:
-	def __init__(self, path):
-		self._path = path
-		self._mtime = 0
-		self._data = None
-
-	def _refresh(self):
-		mtime = os.path.getmtime(self._path)
-		if mtime > self._mtime:
-			self._mtime = mtime
-			with open(self._path, "r") as file:
-				self._data = json.load(file)
-
-	def __getitem__(self, item):
-		self._refresh()
-		return self._data[item]
-		
-	def __getattr__(self, attr):
-		self._refresh()
-		return getattr(self._data, attr)
-
-
 dice_config = _Reader(_paths["dice"])
 emoji_config = _Reader(_paths["emoji"])
 color_config = _Reader(_paths["colors"])
 rolls_config = _Reader(_paths["rolls"])
+memory_config = _Reader(_paths["memory"])
+metrics_config = _Reader(_paths["metrics"])
+limits_config = _Reader(_paths["limits"])
+
+# shared by every process of the bot
+store = Store(_paths["store"])
+# which of the bot's processes this is, set by bot.py when it runs more than one
+cluster = os.environ.get("PUCK_CLUSTER", "0")
+# and how many processes there are in all
+clusters = int(os.environ.get("PUCK_CLUSTERS", "1"))
+# data/xcard.json is copied into the store whenever the bot starts
+xcard_config = StoreView(store, "xcard")
@@ -0,0 +1,138 @@
+from pathlib import Path
+import asyncio
+import re
+
+from discord import DiscordException, HTTPException
+
+from .configs import emoji_config as econ
+from .misc import retry_after
+
+class EmojiSync:
+	"""Uploads the emoji listed in emoji.json to any guild that's missing them"""
+	def __init__(self, concurrency: int = 4, retries: int = 3):
+		self._concurrency = concurrency
+		self._retries = retries
+		self._semaphore = None
+		# path -> image bytes, so each file is only read once
+		self._images = {}
+		# ids of guilds known to have every required emoji
+		self._synced = set()
+
+	def forget(self, guild):
+		"""Mark a guild as needing to be checked again, e.g. after its emoji change"""
+		self._synced.discard(guild.id)
+
+	async def sync(self, guilds):
+		"""Upload any missing emoji to the given guilds, skipping those already done"""
+		# created here so it belongs to the running event loop
+		if self._semaphore is None:
+			self._semaphore = asyncio.Semaphore(self._concurrency)
+
+		required = dict(econ.items())
+		pending = [g for g in guilds if g.id not in self._synced]
+		await asyncio.gather(*(self._sync_guild(g, required) for g in pending))
+
+	async def _sync_guild(self, guild, required):
+		existing = {e.name for e in guild.emojis}
+		missing = [(path, name) for path, name in required.items() if name not in existing]
+		results = await asyncio.gather(*(self._upload(guild, *m) for m in missing))
+		if all(results):
+			self._synced.add(guild.id)
+
+	def _image(self, path):
+		if path not in self._images:
+			self._images[path] = Path(path).read_bytes()
+		return self._images[path]
+
+	async def _upload(self, guild, path, name):
+		"""Upload a single emoji, returning whether it now exists"""
+		try:
+			image = self._image(path)
+		except OSError as e:
+			print(e)
+			return False
+
+		for attempt in range(self._retries):
+			async with self._semaphore:
+				try:
+					print("Uploading emoji:", name)
+					await guild.create_custom_emoji(
+						name=name,
+						image=image,
+						reason="required emoji"
+					)
+					return True
+				except HTTPException as e:
+					if e.status != 429:
+						print(e)
+						return False
+					delay = retry_after(e.response)
+				except DiscordException as e:
+					print(e)
+					return False
+
+			# wait out the rate limit without holding on to a slot, unless there's no next try
+			if attempt < self._retries - 1:
+				await asyncio.sleep(delay)
+
+		print("Gave up uploading emoji after being rate limited:", name)
+		return False
+
+class EmojiIndex:
+	"""A per-guild index of emoji names to the strings that display them"""
+	_regex = re.compile(r":(\w+?):")
+	# the index outside of guilds, which is always empty
+	_none = {}
+
+	def __init__(self):
+		self._guilds = {}
+		# (guild id, category name) -> (category, index, symbol table)
+		self._tables = {}
+
+	def get(self, guild):
+		"""Get the name -> emoji string dict for a guild, building it if needed"""
+		if guild is None:
+			# always the same one, so anything cached against it stays valid
+			return self._none
+		index = self._guilds.get(guild.id)
+		if index is None:
+			index = self.update(guild, guild.emojis)
+		return index
+
+	def update(self, guild, emojis):
+		"""Rebuild the index for a guild from its current emoji"""
+		# reversed, so the first emoji with a given name wins
+		index = {e.name: str(e) for e in reversed(emojis)}
+		self._guilds[guild.id] = index
+		return index
+
+	def discard(self, guild):
+		"""Forget a guild's index and symbol tables, as when leaving it"""
+		self._guilds.pop(guild.id, None)
+		for key in [k for k in self._tables if k[0] == guild.id]:
+			del self._tables[key]
+
+	def table(self, guild, category):
+		"""
+		Get the strings to display a dice category's symbols with in a guild, by symbol id.
+		Symbols without a matching emoji are displayed as written in the config.
+		"""
+		index = self.get(guild)
+		key = (guild and guild.id, category.name)
+		cached = self._tables.get(key)
+		if cached and cached[0] is category and cached[1] is index:
+			return cached[2]
+
+		table = tuple(
+			index.get(name, symbol)
+			for name, symbol in zip(category.emoji, category.symbols)
+		)
+		self._tables[key] = (category, index, table)
+		return table
+
+	def substitute(self, guild, text):
+		"""Replace every ":name:" in the text with that emoji, if the guild has it"""
+		index = self.get(guild)
+		if not index:
+			return text
+		return self._regex.sub(lambda m: index.get(m.group(1), m.group(0)), text)
@@ -0,0 +1,167 @@
+from time import monotonic
+
+from discord.ext import commands as cmds
+
+from .configs import limits_config as lcon
+
+class RateLimited(cmds.CheckFailure):
+	def __init__(self, retry_after: float):
+		self.retry_after = retry_after
+		super().__init__(f"Slow down! Try that again in {max(retry_after, 1):.0f}s.")
+
+class Coalesced(cmds.CheckFailure):
+	"""Raised for a repeat of a command whose reply is already on its way to the channel"""
+
+class TokenBucket:
+	"""Holds up to some capacity of tokens, refilled at a steady rate"""
+	__slots__ = "level", "updated"
+
+	def __init__(self, capacity: float, now: float):
+		self.level = capacity
+		self.updated = now
+
+	def refill(self, capacity: float, rate: float, now: float):
+		self.level = min(capacity, self.level + (now - self.updated) * rate)
+		self.updated = now
+
+	def wait(self, cost: float, rate: float):
+		"""How many seconds until there's enough for the given cost"""
+		return max(cost - self.level, 0) / rate
+
+def coalesce(*, read_only: bool, per_user: bool = False):
+	"""
+	Mark a command's function, under its command decorator, as one whose
+	repeats in a channel, within a short window, are answered by the first
+	one's reply. Repeats are only told apart by their message, so a command
+	that changes anything can't be marked, or a repeat would be dropped.
+	read_only: that the command changes nothing, which it must
+	per_user: only count the same user's repeats, for replies that depend on who asked
+	"""
+	assert read_only, "only commands that change nothing can be coalesced"
+	def decorator(func):
+		# kept on the function, since cogs copy their commands
+		func.__coalesce__ = "user" if per_user else "channel"
+		return func
+	return decorator
+
+class RateLimiter:
+	"""
+	Keeps a token bucket for every user, channel and guild. Every command
+	takes one token from each of its buckets, and rolls take more, by how
+	much work they are, so flooding expensive rolls runs dry quickly. Each
+	guild has its own bucket of the same size, so a busy guild only slows
+	itself down, leaving every other guild the same share as before.
+
+	Read-only commands marked with coalesce() aren't run again while an
+	identical one is running, or just ran, in the same channel, since that
+	one's reply answers both.
+
+	The bot's owner is never limited.
+	"""
+	def __init__(self):
+		# (scope, id) -> TokenBucket, for every bucket not yet full again
+		self._buckets = {}
+		# coalescing key -> when it can run again, or None while it's running
+		self._recent = {}
+		# user id -> when they can next be told they're limited
+		self._warned = {}
+
+	def _owners(self, ctx):
+		yield "user", ctx.author.id
+		yield "channel", ctx.channel.id
+		if ctx.guild is not None:
+			yield "guild", ctx.guild.id
+
+	def weight(self, cost: float):
+		"""How many tokens a roll of the given cost takes, beyond the command's own"""
+		return cost / lcon["cost_unit"]
+
+	async def charge(self, ctx, cost: float = 1):
+		"""Take tokens from all of a context's buckets, or raise RateLimited if any has too few"""
+		if await ctx.bot.is_owner(ctx.author):
+			return
+		self._take(ctx, cost)
+
+	def _take(self, ctx, cost: float = 1):
+		config = lcon.load()
+		now = monotonic()
+		taken = []
+		for scope, owner in self._owners(ctx):
+			capacity, rate = config[scope]["capacity"], config[scope]["rate"]
+			bucket = self._buckets.get((scope, owner))
+			if bucket is None:
+				bucket = self._buckets[(scope, owner)] = TokenBucket(capacity, now)
+			bucket.refill(capacity, rate, now)
+			# anything costing more than a whole bucket just empties it
+			taken.append((bucket, min(cost, capacity), rate))
+
+		wait = max(bucket.wait(need, rate) for bucket, need, rate in taken)
+		if wait > 0:
+			raise RateLimited(wait)
+		for bucket, need, _ in taken:
+			bucket.level -= need
+
+		if len(self._buckets) + len(self._recent) > config["buckets"]:
+			self._prune(config, now)
+
+	def _prune(self, config, now):
+		# a bucket that's refilled is the same as a new one, so it can go
+		for key, bucket in list(self._buckets.items()):
+			scope = config[key[0]]
+			if bucket.level + (now - bucket.updated) * scope["rate"] >= scope["capacity"]:
+				del self._buckets[key]
+		for key, until in list(self._recent.items()):
+			if until is not None and until <= now:
+				del self._recent[key]
+		for key, until in list(self._warned.items()):
+			if until <= now:
+				del self._warned[key]
+
+	@staticmethod
+	def _command(ctx):
+		"""Find the subcommand a context will run, which the library only finds while invoking"""
+		command = ctx.command
+		words = ctx.message.content[len(ctx.prefix) + len(ctx.invoked_with):].split()
+		for word in words:
+			if not isinstance(command, cmds.Group) or word not in command.all_commands:
+				break
+			command = command.all_commands[word]
+		return command
+
+	def _coalesce(self, ctx):
+		command = self._command(ctx)
+		kind = getattr(command.callback, "__coalesce__", None)
+		if kind is None:
+			return
+		key = (command.qualified_name, ctx.channel.id, ctx.author.id if kind == "user" else None, ctx.message.content.strip())
+		if key in self._recent:
+			until = self._recent[key]
+			if until is None or until > monotonic():
+				raise Coalesced()
+		self._recent[key] = None
+		ctx.coalesce_key = key
+
+	def finished(self, ctx):
+		"""Call when a command is done, so its repeats are answered for a little longer"""
+		key = getattr(ctx, "coalesce_key", None)
+		if key is not None:
+			self._recent[key] = monotonic() + lcon["coalesce_window"]
+
+	async def check(self, ctx):
+		"""A global check, run once per command"""
+		if await ctx.bot.is_owner(ctx.author):
+			return True
+		# repeats are charged too, so they can't be sent for free
+		self._take(ctx)
+		self._coalesce(ctx)
+		return True
+
+	def should_warn(self, ctx, error: RateLimited):
+		"""Whether to tell a user they're limited, which only happens once until it wears off"""
+		now = monotonic()
+		if self._warned.get(ctx.author.id, 0) > now:
+			return False
+		self._warned[ctx.author.id] = now + error.retry_after
+		return True
+
+limiter = RateLimiter()
@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from time import monotonic
+import os
+
+class MemberCache:
+	"""
+	Remembers whether users are in guilds whose members aren't all cached,
+	so the same lookup isn't requested from discord again and again. Holds
+	at most "size" answers, dropping the least recently used, and forgets
+	each after "ttl" seconds, since joins and leaves aren't seen.
+	"""
+	def __init__(self, size: int = 10000, ttl: float = 3600.0):
+		self._size = size
+		self._ttl = ttl
+		# (guild id, user id) -> (is a member, when it was looked up)
+		self._entries = OrderedDict()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def get(self, guild_id: int, user_id: int):
+		"""Get whether a user is in a guild, or None if it isn't known"""
+		key = (guild_id, user_id)
+		entry = self._entries.get(key)
+		if entry is None:
+			return None
+		if monotonic() - entry[1] >= self._ttl:
+			del self._entries[key]
+			return None
+		self._entries.move_to_end(key)
+		return entry[0]
+
+	def put(self, guild_id: int, user_id: int, member: bool):
+		key = (guild_id, user_id)
+		self._entries[key] = (member, monotonic())
+		self._entries.move_to_end(key)
+		while len(self._entries) > self._size:
+			self._entries.popitem(last = False)
+
+	def discard_guild(self, guild_id: int):
+		"""Forget everything about a guild, e.g. after leaving it"""
+		for key in [k for k in self._entries if k[0] == guild_id]:
+			del self._entries[key]
+
+def resident_bytes():
+	"""Get how much memory this process has resident, or None if it can't be found"""
+	try:
+		with open("/proc/self/statm", "r") as file:
+			return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except (OSError, ValueError, IndexError):
+		pass
+	try:
+		import resource
+	except ImportError:
+		return None
+	# only the peak is available here, in kilobytes on linux
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def memory_report(bot, members: MemberCache = None):
+	"""Describe the bot's memory use, overall and per guild"""
+	rss = resident_bytes()
+	guilds = len(bot.guilds)
+	lines = [f"Guilds: {guilds}"]
+	if rss is not None:
+		lines.append(f"Resident memory: {rss / 2**20:.1f} MiB")
+		if guilds:
+			lines.append(f"Per guild: {rss / guilds / 2**10:.1f} KiB")
+	lines.append(f"Cached users: {len(bot.users)}")
+	lines.append(f"Cached members: {sum(len(g.members) for g in bot.guilds)}")
+	lines.append(f"Cached messages: {len(bot.cached_messages)}")
+	if members is not None:
+		lines.append(f"Remembered memberships: {len(members)}")
+	return "\n".join(lines)
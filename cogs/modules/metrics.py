@@ -0,0 +1,194 @@
+from collections import Counter
+from pathlib import Path
+import asyncio
+import os
+import time
+
+from discord.ext import commands as cmds
+
+class Metrics:
+	"""
+	Counts commands and their failures per cog, and watches how long the
+	event loop is kept from running anything, then exports it all in the
+	Prometheus text format. It hooks into the bot's command events, so no
+	command needs to know about it.
+	"""
+	# upper bounds of the lag histogram's buckets, in seconds
+	_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+	def __init__(
+			self,
+			cluster: str = "0",
+			lag_interval: float = 0.1,
+			slow_threshold: float = 0.25,
+			file: str = None,
+			write_interval: float = 15.0,
+			port: int = None
+		):
+		"""
+		lag_interval: how many seconds apart the event loop is checked
+		slow_threshold: log any time the event loop is held up longer than this many seconds
+		file: a path to keep the metrics written to, with "{cluster}" replaced, if any
+		write_interval: how many seconds apart the file is written
+		port: a local port to serve the metrics over HTTP on, if any. each cluster takes the next port up
+		"""
+		self._cluster = cluster
+		self._lag_interval = lag_interval
+		self._slow_threshold = slow_threshold
+		self._file = file and Path(file.format(cluster = cluster))
+		self._write_interval = write_interval
+		self._port = port and port + int(cluster)
+
+		# (cog, command) -> count
+		self._commands = Counter()
+		self._errors = Counter()
+		self._conversions = Counter()
+		self._seconds = Counter()
+		# commands running now. when each started, and whether its arguments were converted, is kept on its context
+		self._running = set()
+
+		self._lag_counts = [0] * (len(self._buckets) + 1)
+		self._lag_sum = 0.0
+		self._lag_max = 0.0
+		self._slow = 0
+		self._tasks = []
+
+	@staticmethod
+	def _key(ctx):
+		command = ctx.command
+		if command is None:
+			return ("none", "unknown")
+		return (command.cog_name or "none", command.qualified_name)
+
+	def started(self, ctx):
+		"""Call when a command is invoked, before its checks and converters"""
+		ctx.metrics_start = time.perf_counter()
+		ctx.metrics_converted = False
+		self._running.add(ctx)
+
+	async def check(self, ctx):
+		"""
+		A global check, run once per command before any other, that calls
+		started(). The command event would be too late, as events are only
+		dispatched once the command is already running
+		"""
+		self.started(ctx)
+		return True
+
+	def converted(self, ctx):
+		"""Call once a command's checks and converters have passed"""
+		ctx.metrics_converted = True
+
+	def finished(self, ctx, error = None):
+		"""Call when a command ends, with the error it raised if it failed"""
+		# by now a group's context holds the subcommand that actually ran
+		key = self._key(ctx)
+		self._commands[key] += 1
+		self._running.discard(ctx)
+		start = getattr(ctx, "metrics_start", None)
+		converted = getattr(ctx, "metrics_converted", True)
+		if start is not None:
+			self._seconds[key] += time.perf_counter() - start
+		if error is None:
+			return
+		self._errors[key] += 1
+		# anything raised before the command ran, other than a failed check, came from its arguments
+		if not converted and not isinstance(error, (cmds.CheckFailure, cmds.CommandNotFound)):
+			self._conversions[key] += 1
+
+	def start(self, loop):
+		"""Start watching the event loop, and exporting, on the given loop"""
+		self._tasks.append(loop.create_task(self._watch()))
+		if self._file is not None:
+			self._tasks.append(loop.create_task(self._write_periodically()))
+		if self._port is not None:
+			self._tasks.append(loop.create_task(
+				asyncio.start_server(self._serve, "127.0.0.1", self._port)
+			))
+
+	async def _watch(self):
+		loop = asyncio.get_event_loop()
+		while True:
+			start = loop.time()
+			await asyncio.sleep(self._lag_interval)
+			lag = max(loop.time() - start - self._lag_interval, 0.0)
+
+			self._lag_sum += lag
+			self._lag_max = max(self._lag_max, lag)
+			bucket = next((i for i, bound in enumerate(self._buckets) if lag <= bound), len(self._buckets))
+			self._lag_counts[bucket] += 1
+
+			if lag >= self._slow_threshold:
+				self._slow += 1
+				# whatever held the loop up ran while these were in progress
+				running = ", ".join(sorted({ctx.command.qualified_name for ctx in self._running if ctx.command})) or "no commands"
+				print(f"Event loop held up for {lag * 1000:.0f}ms, running: {running}")
+
+	def render(self):
+		"""Get every metric in the Prometheus text format"""
+		cluster = f"cluster=\"{self._cluster}\""
+		lines = []
+
+		def counter(name, help, values):
+			lines.append(f"# HELP {name} {help}")
+			lines.append(f"# TYPE {name} counter")
+			for (cog, command), value in sorted(values.items()):
+				lines.append(f"{name}{{{cluster},cog=\"{cog}\",command=\"{command}\"}} {value}")
+
+		counter("puck_commands_total", "Commands invoked.", self._commands)
+		counter("puck_command_errors_total", "Commands that raised an error.", self._errors)
+		counter("puck_converter_failures_total", "Commands whose arguments couldn't be converted.", self._conversions)
+		counter("puck_command_seconds_total", "Time spent running commands.", self._seconds)
+
+		lines.append("# HELP puck_event_loop_lag_seconds How late the event loop was to wake a sleeping task.")
+		lines.append("# TYPE puck_event_loop_lag_seconds histogram")
+		total = 0
+		for bound, count in zip(self._buckets + ("+Inf",), self._lag_counts):
+			total += count
+			lines.append(f"puck_event_loop_lag_seconds_bucket{{{cluster},le=\"{bound}\"}} {total}")
+		lines.append(f"puck_event_loop_lag_seconds_sum{{{cluster}}} {self._lag_sum}")
+		lines.append(f"puck_event_loop_lag_seconds_count{{{cluster}}} {total}")
+
+		lines.append("# HELP puck_event_loop_lag_max_seconds The longest the event loop has been held up.")
+		lines.append("# TYPE puck_event_loop_lag_max_seconds gauge")
+		lines.append(f"puck_event_loop_lag_max_seconds{{{cluster}}} {self._lag_max}")
+
+		lines.append("# HELP puck_slow_callbacks_total Times the event loop was held up past the slow threshold.")
+		lines.append("# TYPE puck_slow_callbacks_total counter")
+		lines.append(f"puck_slow_callbacks_total{{{cluster}}} {self._slow}")
+		return "\n".join(lines) + "\n"
+
+	def write(self):
+		"""Write the metrics file, replacing it whole so it's never read half written"""
+		self._file.parent.mkdir(parents = True, exist_ok = True)
+		temp = self._file.with_name(self._file.name + ".tmp")
+		temp.write_text(self.render())
+		os.replace(temp, self._file)
+
+	async def _write_periodically(self):
+		while True:
+			await asyncio.sleep(self._write_interval)
+			try:
+				self.write()
+			except OSError as e:
+				print("Could not write metrics:", e)
+
+	async def _serve(self, reader, writer):
+		"""Answer any HTTP request with the metrics"""
+		try:
+			# the request itself doesn't matter, only that it's been sent
+			while (await reader.readline()).strip():
+				pass
+			body = self.render().encode()
+			writer.write(
+				b"HTTP/1.1 200 OK\r\n"
+				b"Content-Type: text/plain; version=0.0.4\r\n"
+				+ f"Content-Length: {len(body)}\r\n".encode()
+				+ b"Connection: close\r\n\r\n"
+				+ body
+			)
+			await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
@@ -1,21 +1,46 @@
 from datetime import datetime, timedelta
+from itertools import groupby
+from random import Random, getrandbits
 import asyncio
-import shelve
 import re
 
 from discord.ext import commands as cmds
 
+from .configs import store
+
+def retry_after(response, default = 1.0):
+	"""Get how many seconds a rate limited response asks to wait"""
+	headers = getattr(response, "headers", None) or {}
+	for header in ("X-RateLimit-Reset-After", "Retry-After"):
+		try:
+			return float(headers[header])
+		except (KeyError, ValueError):
+			continue
+	return default
+
 class TimerLockError(RuntimeError): pass
 class Timer:
 	def __init__(self, time: int):
 		self._time = time
 		self._starttime = None
 		self._endtime = None
+		# the shard whose process runs this timer
+		self._shard = None
 
 	@classmethod
 	def get(cls, timerid):
-		with shelve.open("data/timers.shelf") as shelf:
-			return shelf[timerid] if timerid in shelf else None
+		# only a read, so it doesn't need the write lock
+		return store.open("timers").get_many([timerid]).get(timerid)
+
+	@classmethod
+	def clear(cls, shards):
+		"""Forget every timer run by the given shards, so other processes' timers are left alone"""
+		with store.open("timers") as shelf:
+			for timerid in list(shelf):
+				timer = shelf[timerid]
+				# timers saved without a shard predate sharding, and are stale
+				if timer is None or getattr(timer, "_shard", None) in (None, *shards):
+					del shelf[timerid]
 
 	@property
 	def elapsed(self):
@@ -34,18 +59,19 @@ class Timer:
 	def length(self):
 		return self._time
 
-	async def start(self, timerid: str):
+	async def start(self, timerid: str, shard: int = 0):
 		self._starttime = datetime.now()
 		self._endtime = self._starttime + timedelta(seconds=self._time)
+		self._shard = shard
 
-		with shelve.open("data/timers.shelf") as shelf:
+		with store.open("timers") as shelf:
 			shelf[timerid] = self
 
 		await asyncio.sleep(self._time)
 		return self.get(timerid) and True
 
 	async def stop(self, timerid: str):
-		with shelve.open("data/timers.shelf") as shelf:
+		with store.open("timers") as shelf:
 			shelf[timerid] = None
 
 class TimerConverterError(cmds.CommandError): pass
@@ -77,4 +103,43 @@ class TimerConverter(cmds.Converter):
 		else:
 			seconds += int(first)  * self._converters[size or "m"]
 
-		return Timer(seconds)
\ No newline at end of file
+		return Timer(seconds)
+
+class Shuffle:
+	"""
+	A shuffled list of items, each possibly repeated many times.
+	Only (item, count) pairs are stored, and the shuffled order is generated
+	lazily from a seed, so the same order can be read again from the start.
+	"""
+	def __init__(self, counts, seed: int = None):
+		merged = {}
+		for item, count in counts:
+			if count > 0:
+				merged[item] = merged.get(item, 0) + count
+		self._counts = tuple(merged.items())
+		self._seed = getrandbits(64) if seed is None else seed
+
+	def __len__(self):
+		return sum(c for _, c in self._counts)
+
+	def __iter__(self):
+		rng = Random(self._seed)
+		items = [i for i, _ in self._counts]
+		remaining = [c for _, c in self._counts]
+		total = sum(remaining)
+		while total:
+			# drawing each item with odds proportional to how many of it are
+			# left (multivariate hypergeometric sampling, one draw at a time)
+			# makes every ordering of the whole list equally likely
+			pick = rng.randrange(total)
+			for i, count in enumerate(remaining):
+				if pick < count: break
+				pick -= count
+			remaining[i] -= 1
+			total -= 1
+			yield items[i]
+
+	def runs(self):
+		"""Iterate over the shuffled order as (item, times repeated in a row) pairs"""
+		for item, group in groupby(self):
+			yield item, sum(1 for _ in group)
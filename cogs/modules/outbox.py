@@ -0,0 +1,118 @@
+from collections import deque
+import asyncio
+import inspect
+
+from discord import HTTPException
+from discord.abc import Messageable
+
+from .misc import retry_after
+
+class Outbox:
+	"""
+	Sends messages through one queue per channel, merging whatever is queued
+	for the same channel into as few messages as Discord's limits allow.
+	Each channel only ever has one send in flight, so while it's waiting on
+	Discord (or a rate limit) new messages pile up, and go out merged.
+
+	Texts are joined into one message, along with as many embeds as the
+	library can send at once, which is only one before discord.py 2.0.
+	Text is shown above embeds, so none is merged in after one, to keep
+	everything in the order it was queued.
+
+	A message for an idle channel goes straight out. Otherwise whatever
+	piled up waits a moment for more before it's sent.
+	"""
+	# Discord's limits on a single message
+	max_content = 2000
+	max_embed_size = 6000
+	# discord.py only takes a list of embeds from 2.0 on, and one at a time before
+	max_embeds = 10 if "embeds" in inspect.signature(Messageable.send).parameters else 1
+
+	def __init__(self, window: float = 0.05, retries: int = 3):
+		"""
+		window: how many seconds to wait for more messages, once some are waiting
+		retries: how many times to try again after being rate limited
+		"""
+		self._window = window
+		self._retries = retries
+		# channel id -> deque of (content, embed, future) waiting to be sent
+		self._queues = {}
+
+	def post(self, channel, content: str = None, *, embed = None):
+		"""
+		Queue a message straight away, returning a future of the message it
+		goes out in. Messages posted one after another go out in that order
+		"""
+		future = asyncio.get_event_loop().create_future()
+		queue = self._queues.get(channel.id)
+		if queue is None:
+			queue = self._queues[channel.id] = deque()
+			asyncio.ensure_future(self._drain(channel, queue))
+		queue.append((content, embed, future))
+		return future
+
+	async def send(self, channel, content: str = None, *, embed = None):
+		"""Queue a message, returning the message it went out in once it's sent"""
+		return await self.post(channel, content, embed = embed)
+
+	def _take(self, queue):
+		"""Take as many queued messages as fit in one"""
+		batch = [queue.popleft()]
+		length = len(batch[0][0] or "")
+		embeds = [batch[0][1]] if batch[0][1] is not None else []
+		size = sum(map(len, embeds))
+		while queue:
+			content, embed, _ = queue[0]
+			if content and embeds:
+				# it would show above the embeds before it
+				break
+			# merged contents are joined with a newline
+			new_length = length + (len(content) + bool(length) if content else 0)
+			new_embeds = len(embeds) + (embed is not None)
+			new_size = size + (len(embed) if embed is not None else 0)
+			if new_length > self.max_content or new_embeds > self.max_embeds or new_size > self.max_embed_size:
+				break
+			batch.append(queue.popleft())
+			length, size = new_length, new_size
+			if embed is not None:
+				embeds.append(embed)
+		return batch, embeds
+
+	async def _drain(self, channel, queue):
+		# the first messages, queued while the channel was idle, go straight out
+		idle = True
+		try:
+			while queue:
+				if not idle:
+					# these piled up behind the last send, and more may be coming
+					await asyncio.sleep(self._window)
+				idle = False
+				batch, embeds = self._take(queue)
+				content = "\n".join(c for c, _, _ in batch if c) or None
+				try:
+					message = await self._send(channel, content, embeds)
+				except Exception as e:
+					for _, _, future in batch:
+						if not future.done():
+							future.set_exception(e)
+				else:
+					for _, _, future in batch:
+						if not future.done():
+							future.set_result(message)
+		finally:
+			# anything queued from here on starts a new drain
+			del self._queues[channel.id]
+
+	async def _send(self, channel, content, embeds):
+		for attempt in range(self._retries + 1):
+			try:
+				if self.max_embeds > 1:
+					return await channel.send(content, embeds = embeds)
+				return await channel.send(content, embed = embeds[0] if embeds else None)
+			except HTTPException as e:
+				if e.status != 429 or attempt == self._retries:
+					raise
+				# hold back this channel, and so everything queued for it, until the limit resets
+				await asyncio.sleep(retry_after(e.response))
+
+outbox = Outbox()
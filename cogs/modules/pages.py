@@ -0,0 +1,180 @@
+from itertools import islice
+import asyncio
+import re
+
+from discord import HTTPException, Object
+
+# where text can be broken without cutting a word or a custom emoji in half
+_breaks = re.compile(r"(\s+|<a?:\w+:\d+>)")
+
+def split_text(text: str, limit: int):
+	"""Break text into pieces of at most "limit" characters, between words or emoji where possible"""
+	chunk = ""
+	for piece in _breaks.split(text):
+		if len(chunk) + len(piece) > limit:
+			if chunk.strip():
+				yield chunk
+			chunk = ""
+			if piece.isspace():
+				continue
+			# only a single word longer than a whole piece is cut
+			while len(piece) > limit:
+				yield piece[:limit]
+				piece = piece[limit:]
+		chunk += piece
+	if chunk.strip():
+		yield chunk
+
+def shorten(text: str, limit: int):
+	"""Cut text down to at most "limit" characters, between words or emoji, marking that it was cut"""
+	if len(text) <= limit:
+		return text
+	return next(split_text(text, limit - 1), "").rstrip() + "\N{HORIZONTAL ELLIPSIS}"
+
+class Paginator:
+	"""
+	Sends rows of output as pages of embeds, navigated with reactions.
+	Pages are rendered only when shown, by reading the rows again from the
+	start of that page, so only one page is ever held in memory.
+	"""
+	_first = "\N{BLACK LEFT-POINTING DOUBLE TRIANGLE}"
+	_prev = "\N{BLACK LEFT-POINTING TRIANGLE}"
+	_next = "\N{BLACK RIGHT-POINTING TRIANGLE}"
+
+	def __init__(self, rows, build, limit = 2048, max_rows = None, size = len, timeout = 120.0):
+		"""
+		rows: called with no arguments to get a fresh iterator of every row, in the same order each time
+		build: called with the rows of a page to get its embed
+		limit: the most a page's rows can add up to, as measured by "size"
+		max_rows: the most rows a page can have, if limited
+		size: measures a row. string rows longer than "limit" are split up
+		timeout: how many seconds without any navigation before the pages are dropped
+		"""
+		self._rows = rows
+		self._build = build
+		self._limit = limit
+		self._max_rows = max_rows
+		self._size = size
+		self._timeout = timeout
+		# the row each page found so far starts at
+		self._starts = [0]
+		# the index of the last page, once it's been found
+		self._last = None
+
+	def _split(self, rows):
+		"""Break up any string rows too long to fit on a page"""
+		for row in rows:
+			if isinstance(row, str) and len(row) > self._limit:
+				yield from split_text(row, self._limit)
+			else:
+				yield row
+
+	@classmethod
+	def rendered(cls, pages, timeout = 120.0):
+		"""Get a Paginator that shows pages already rendered by pages(), such as cached ones"""
+		paginator = cls(lambda: iter(pages), lambda page: page[0].copy(), max_rows = 1, size = lambda ebd: 0, timeout = timeout)
+		# every page is known up front, so the page count can be shown right away
+		paginator._starts = list(range(len(pages)))
+		paginator._last = len(pages) - 1
+		return paginator
+
+	def pages(self):
+		"""Render every page up front, without page numbers"""
+		pages = [self._render(0)]
+		while self._last is None:
+			pages.append(self._render(len(pages)))
+		return pages
+
+	def _render(self, number):
+		"""Render a single page's embed"""
+		start = self._starts[number]
+		page = []
+		used = 0
+		for row in islice(self._split(self._rows()), start, None):
+			# rows are joined by newlines, so count one for each
+			size = self._size(row) + 1
+			full = used + size > self._limit \
+				or (self._max_rows is not None and len(page) >= self._max_rows)
+			if page and full:
+				# there's at least one more page, so remember where it starts
+				if len(self._starts) == number + 1:
+					self._starts.append(start + len(page))
+				break
+			page.append(row)
+			used += size
+		else:
+			self._last = number
+
+		return self._build(page)
+
+	def _page(self, number):
+		"""Render a single page, numbered if there's more than one"""
+		ebd = self._render(number)
+		if self._last != 0:
+			total = "?" if self._last is None else self._last + 1
+			footer = f"Page {number + 1} of {total}"
+			# keep any footer the embed already has
+			if ebd.footer.text:
+				footer = f"{ebd.footer.text} \N{BULLET} {footer}"
+			ebd.set_footer(text = footer)
+		return ebd
+
+	async def send(self, ctx):
+		"""Send the first page, and keep listening for navigation in the background"""
+		message = await ctx.send(embed = self._page(0))
+		if self._last != 0:
+			ctx.bot.loop.create_task(self._navigate(ctx, message))
+		return message
+
+	async def _navigate(self, ctx, message):
+		controls = (self._first, self._prev, self._next)
+		try:
+			for emoji in controls:
+				await message.add_reaction(emoji)
+		except HTTPException:
+			return
+
+		# raw events arrive even when the message isn't cached, so the message cache can be off
+		def check(payload):
+			return payload.message_id == message.id \
+				and payload.user_id != ctx.bot.user.id \
+				and not (payload.member is not None and payload.member.bot) \
+				and str(payload.emoji) in controls
+
+		number = 0
+		while True:
+			try:
+				payload = await ctx.bot.wait_for(
+					"raw_reaction_add",
+					check = check,
+					timeout = self._timeout
+				)
+			except asyncio.TimeoutError:
+				break
+
+			emoji = str(payload.emoji)
+			if emoji == self._first:
+				new = 0
+			elif emoji == self._prev:
+				new = max(number - 1, 0)
+			elif self._last is None or number < self._last:
+				new = number + 1
+			else:
+				new = number
+
+			# this needs the manage messages permission, which is optional
+			try:
+				await message.remove_reaction(payload.emoji, Object(payload.user_id))
+			except HTTPException:
+				pass
+
+			if new != number:
+				number = new
+				await message.edit(embed = self._page(number))
+
+		# stop showing the controls, and let go of the rows
+		self._rows = None
+		try:
+			await message.clear_reactions()
+		except HTTPException:
+			pass
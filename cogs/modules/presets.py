@@ -0,0 +1,312 @@
+from collections import OrderedDict
+import re
+
+from discord.ext import commands as cmds
+
+from puckdice.engine import Token
+from .configs import rolls_config as rcon
+from .configs import store
+
+class PresetExpansionError(cmds.CommandError): pass
+class PresetGraph:
+	"""
+	Keeps the presets of every scope: a user's, a channel's, a guild's, and
+	global ones, which the bot's owner can add to those in rolls.json. Each
+	preset is stored under its own key, so finding one never reads another.
+
+	A stored preset is a small versioned record of its text, with whitespace
+	normalized, and a plan of the tokens it parses to, made with Token.dump.
+	Nothing in it depends on how Token is laid out, and a plan made by an
+	older tokenizer, or with other special dice, is ignored and made again.
+
+	Presets can refer to other presets, as "@name" for one copy or "N@name"
+	for N copies in a row. Each preset is a node, found by its (scope, name).
+	A channel's scope carries the guild it's in, as ("channel", id, guild id).
+	A reference looks in the preset's own scope, then the scopes around it,
+	so expanding a preset gives the same tokens wherever it's used. A preset
+	referring to its own name means the one in the next scope out, so a user's
+	"stat" can be "@stat +1" on top of the global "stat". Every
+	expansion is remembered until something it looked at changes. Only those
+	dependents are forgotten when a preset changes.
+	"""
+	# at most a few digits of repeats, so a count is never huge
+	_reference = re.compile(r"^(\d{0,3})@(\w+)$")
+	# the longest a preset can expand to, so repeats can't blow up
+	max_length = 4000
+	# how many expansions, or known missing presets, to remember
+	memo_size = 10000
+	# the layout of stored records, as (format, text, plan key, plan)
+	_format = 1
+
+	def __init__(self):
+		# node -> (expanded text, tokens), or None if there's no such preset,
+		# least recently used first. a forgotten node is just expanded again
+		self._memo = OrderedDict()
+		# node -> the nodes whose expansions looked it up, and the reverse,
+		# so a forgotten node can be taken out of everything it looked up
+		self._dependents = {}
+		self._lookups = {}
+		# the global presets, the store version, and the plan key the memo was made from
+		self._globals = None
+		self._version = None
+		self._plan_key = None
+
+	@staticmethod
+	def channel(ctx):
+		"""Get the scope of a context's channel"""
+		return ("channel", ctx.channel.id, ctx.guild and ctx.guild.id)
+
+	def scopes(self, ctx, uid: int = None):
+		"""Get the scopes a user's roll in a context uses, in order of precedence"""
+		user = ("user", uid or ctx.author.id)
+		if ctx.guild is None:
+			return (user, self.channel(ctx), ("global",))
+		return (user, self.channel(ctx), ("guild", ctx.guild.id), ("global",))
+
+	def chain(self, scope):
+		"""Get the scopes a preset in the given scope can see, innermost first"""
+		if scope[0] == "global":
+			return (scope,)
+		if scope[0] == "channel" and scope[2] is not None:
+			return (scope, ("guild", scope[2]), ("global",))
+		return (scope, ("global",))
+
+	@staticmethod
+	def key(scope, name: str):
+		"""Get the key a preset is stored under"""
+		# a channel's guild is left out, as the channel alone identifies it
+		return " ".join(map(str, (*scope[:2], name)))
+
+	@classmethod
+	def _encode(cls, tokens):
+		"""Make the record a preset is stored as, from its tokens"""
+		text = " ".join("".join(t.raw for t in tokens).split())
+		return (cls._format, text, Token.plan_key(), Token.dump(Token.parse(text)))
+
+	@staticmethod
+	def _decode(stored):
+		"""Get a stored preset's text, and its plan if it can still be used"""
+		if isinstance(stored, list):
+			# stored before records, as tokens, which keep the text they came from
+			return "".join(t.raw for t in stored).strip(), None
+		_, text, key, plan = stored
+		return text, (plan if key == Token.plan_key() else None)
+
+	def _source(self, node, fetched = None):
+		"""Read a preset as (text, plan or None), or None if it doesn't exist"""
+		scope, name = node
+		key = self.key(scope, name)
+		if fetched is not None:
+			# already looked for, along with the rest of the scopes
+			stored = fetched.get(key)
+		else:
+			shelf = store.open("presets")
+			stored = shelf[key] if key in shelf else None
+
+		if stored is not None:
+			return self._decode(stored)
+		if scope[0] == "global" and rcon.get(name) is not None:
+			return rcon[name], None
+		return None
+
+	def _refresh(self):
+		"""Forget whatever was expanded from presets changed elsewhere"""
+		version = store.version("presets")
+		if version != self._version:
+			# another process changed something, and there's no telling what
+			self._clear()
+			self._version = version
+
+		plan_key = Token.plan_key()
+		if plan_key != self._plan_key:
+			# the special dice changed, so anything may tokenize differently
+			self._clear()
+			self._plan_key = plan_key
+
+		model = rcon.load()
+		if model is not self._globals:
+			self._globals = model
+			for node in [n for n in self._memo if n[0][0] == "global"]:
+				self.invalidate(*node)
+
+	def _clear(self):
+		self._memo.clear()
+		self._dependents.clear()
+		self._lookups.clear()
+
+	def _forget(self, node):
+		"""Drop a node's expansion, and take it out of the dependents of whatever it looked up"""
+		self._memo.pop(node, None)
+		for probe in self._lookups.pop(node, ()):
+			dependents = self._dependents.get(probe)
+			if dependents is not None:
+				dependents.discard(node)
+				if not dependents:
+					del self._dependents[probe]
+
+	def _expand(self, node, stack, memo, dependents, lookups, source):
+		if node in memo:
+			return memo[node]
+		if node in stack:
+			path = " -> ".join(f"@{name}" for _, name in stack[stack.index(node):] + [node])
+			raise PresetExpansionError(f"Presets refer to each other in a loop: {path}")
+
+		stored = source(node)
+		if stored is None:
+			memo[node] = None
+			return None
+		text, plan = stored
+
+		stack.append(node)
+		words = []
+		# how long the words so far are once joined, checked before adding any
+		length = -1
+		for word in text.split():
+			match = self._reference.match(word)
+			target = None
+			if match is not None:
+				count, name = match.groups()
+				for scope in self.chain(node[0]):
+					probe = (scope, name.lower())
+					if probe == node:
+						# its own name, which means the one further out
+						continue
+					# a miss is remembered too, in case the preset is made later
+					dependents.setdefault(probe, set()).add(node)
+					lookups.setdefault(node, set()).add(probe)
+					target = self._expand(probe, stack, memo, dependents, lookups, source)
+					if target is not None:
+						break
+			if target is None:
+				# not a reference, or to nothing, so it's left as written
+				added, repeats = word, 1
+			else:
+				added, repeats = target[0], int(count or 1)
+			# measured before any copies are made, so a large count can't use up memory
+			length += repeats * (len(added) + 1)
+			if length > self.max_length:
+				raise PresetExpansionError(f"Preset \"{node[1]}\" expands to more than {self.max_length} characters")
+			words.extend([added] * repeats)
+		stack.pop()
+
+		expanded = " ".join(words)
+		if plan is not None and expanded == text:
+			# nothing was substituted, so the stored plan still holds
+			tokens = Token.load(text, plan)
+		else:
+			tokens = Token.parse(expanded)
+		memo[node] = (expanded, tokens)
+		return memo[node]
+
+	def _get(self, node, source):
+		if node in self._memo:
+			self._memo.move_to_end(node)
+			result = self._memo[node]
+		else:
+			result = self._expand(node, [], self._memo, self._dependents, self._lookups, source)
+			while len(self._memo) > self.memo_size:
+				# whatever used it is still remembered, so its own dependents stay
+				self._forget(next(iter(self._memo)))
+		return None if result is None else result[1]
+
+	def get(self, scope, name: str):
+		"""Get the tokens a preset expands to, or None if it doesn't exist"""
+		self._refresh()
+		return self._get((scope, name), self._source)
+
+	def resolve(self, scopes, name: str):
+		"""Get the tokens of the first of the given scopes' presets with a name, or None"""
+		self._refresh()
+		nodes = [(scope, name) for scope in scopes]
+		# whatever isn't remembered is read in one query, rather than one per scope
+		fetched = None
+		missing = [self.key(*node) for node in nodes if node not in self._memo]
+		if missing:
+			fetched = store.open("presets").get_many(missing)
+		source = lambda node: self._source(node, fetched if node in nodes else None)
+
+		for node in nodes:
+			tokens = self._get(node, source)
+			if tokens is not None:
+				return tokens
+		return None
+
+	def names(self, scopes):
+		"""Get the names of every preset in some scopes, without reading any of them"""
+		shelf = store.open("presets")
+		names = set()
+		for scope in scopes:
+			prefix = self.key(scope, "")
+			names.update(key[len(prefix):] for key in shelf.prefixed(prefix))
+			if scope[0] == "global":
+				names.update(rcon.keys())
+		return names
+
+	def check(self, scope, name: str, text: str):
+		"""Raise PresetExpansionError if a preset can't be set to the given text, as it would loop or be too long"""
+		self._refresh()
+		node = (scope, name)
+		source = lambda n: (text, None) if n == node else self._source(n)
+		# worked out apart from the memo, since the preset isn't set yet
+		self._expand(node, [], {}, {}, {}, source)
+
+	def set(self, scope, name: str, tokens):
+		"""Set a preset, raising PresetExpansionError if it can't be used"""
+		record = self._encode(tokens)
+		self.check(scope, name, record[1])
+		with store.open("presets") as shelf:
+			shelf[self.key(scope, name)] = record
+		self.changed(scope, name)
+
+	def remove(self, scope, name: str):
+		"""Remove a preset, returning whether there was one"""
+		with store.open("presets") as shelf:
+			key = self.key(scope, name)
+			found = key in shelf
+			if found:
+				del shelf[key]
+		# which forgets it and everything that looked it up, so none of them are left in _dependents
+		self.changed(scope, name)
+		return found
+
+	def invalidate(self, scope, name: str):
+		"""Forget the expansion of a preset, and of every preset that used it"""
+		pending = [(scope, name)]
+		while pending:
+			node = pending.pop()
+			pending.extend(self._dependents.get(node, ()))
+			# which takes it out of every set it's in, so it isn't found again
+			self._forget(node)
+
+	def changed(self, scope, name: str):
+		"""Call after changing a preset in the store, from this process"""
+		self.invalidate(scope, name)
+		version = store.version("presets")
+		# if nothing else changed since, this process's change only needs its dependents forgotten
+		if self._version is not None and version == self._version + 1:
+			self._version = version
+
+	@classmethod
+	def migrate(cls):
+		"""
+		Split presets kept as one dict per kind of scope into a key per
+		preset, and store any kept as tokens, or with a stale plan, afresh
+		"""
+		with store.open("presets") as shelf:
+			for kind in ("user", "channel"):
+				if kind not in shelf:
+					continue
+				for owner, presets in shelf[kind].items():
+					for name, tokens in presets.items():
+						shelf[cls.key((kind, owner), name)] = cls._encode(tokens)
+				del shelf[kind]
+
+			plan_key = Token.plan_key()
+			for key in list(shelf):
+				stored = shelf[key]
+				if isinstance(stored, list):
+					shelf[key] = cls._encode(stored)
+				elif stored[2] != plan_key:
+					shelf[key] = (cls._format, stored[1], plan_key, Token.dump(Token.parse(stored[1])))
+
+preset_graph = PresetGraph()
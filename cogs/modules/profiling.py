@@ -0,0 +1,53 @@
+from pathlib import Path
+import cProfile
+import os
+import pstats
+import tracemalloc
+
+import puckdice
+from . import dice as _dice
+
+# allocations are only reported from the dice code: the converters, and the engine they re-export
+_dice_files = (
+	tracemalloc.Filter(True, _dice.__file__),
+	tracemalloc.Filter(True, os.path.join(os.path.dirname(puckdice.__file__), "*"))
+)
+
+async def profile(run, functions: int = 15, lines: int = 10):
+	"""
+	Await run() once under cProfile and tracemalloc, and describe where the
+	time and memory went. Nothing is traced outside of this call.
+	"""
+	profiler = cProfile.Profile()
+	tracemalloc.start()
+	before = tracemalloc.take_snapshot()
+	profiler.enable()
+	try:
+		await run()
+	finally:
+		profiler.disable()
+		after = tracemalloc.take_snapshot()
+		tracemalloc.stop()
+
+	stats = pstats.Stats(profiler)
+	stats.sort_stats("cumulative")
+	report = [f"Top {functions} functions by cumulative time:", f"{'cumulative':>12}{'own':>10}{'calls':>9}  function"]
+	for func in stats.fcn_list[:functions]:
+		_, calls, own, cumulative, _ = stats.stats[func]
+		file, line, name = func
+		where = name if file == "~" else f"{Path(file).name}:{line}({name})"
+		report.append(f"{cumulative * 1000:>10.2f}ms{own * 1000:>8.2f}ms{calls:>9}  {where}")
+
+	diff = after.filter_traces(_dice_files).compare_to(before.filter_traces(_dice_files), "lineno")
+	report.append("")
+	report.append(f"Top {lines} lines of dice code by memory allocated:")
+	for entry in diff[:lines]:
+		frame = entry.traceback[0]
+		report.append(f"{entry.size_diff / 1024:>10.1f}KiB{entry.count_diff:>9} blocks  {Path(frame.filename).name}:{frame.lineno}")
+	if not diff:
+		report.append("(none)")
+
+	# the run also covers anything else the event loop did meanwhile
+	report.append("")
+	report.append("Times include anything else running at the same time, and tracing overhead.")
+	return "\n".join(report)
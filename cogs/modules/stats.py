@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from time import monotonic
+import asyncio
+
+from puckdice.stats import DieStats
+
+class RollStats:
+	"""
+	Per-user and per-channel statistics of every die rolled. Each scope is
+	read from the store the first time it's used, then kept in memory, and
+	what this process has added is merged into the store every "interval"
+	seconds. Merging rather than overwriting means every process can add to
+	the same scopes. At most "size" scopes are kept, dropping the least
+	recently used, whose additions are merged into the store as they go.
+	"""
+	def __init__(self, store, namespace: str = "stats", interval: float = 60.0, size: int = 10000):
+		self._store = store
+		self._namespace = namespace
+		self._interval = interval
+		self._size = size
+		# "user id" or "channel id" -> {die name: DieStats}, least recently used first
+		self._scopes = OrderedDict()
+		# the same, but only what's been rolled here since the last flush
+		self._deltas = {}
+		self._flushed = monotonic()
+		self._task = None
+
+	def __len__(self):
+		return len(self._scopes)
+
+	def get(self, key: str):
+		"""Get the stats for a scope by die name, loading them if needed"""
+		scope = self._scopes.get(key)
+		if scope is None:
+			shelf = self._store.open(self._namespace)
+			scope = shelf[key] if key in shelf else {}
+			self._scopes[key] = scope
+			self._evict()
+		else:
+			self._scopes.move_to_end(key)
+		return scope
+
+	def _evict(self):
+		dropped = {}
+		while len(self._scopes) > self._size:
+			key, _ = self._scopes.popitem(last = False)
+			if key in self._deltas:
+				dropped[key] = self._deltas.pop(key)
+		if dropped:
+			# nothing rolled is lost, even though the scope is forgotten
+			with self._store.open(self._namespace) as shelf:
+				for key, delta in dropped.items():
+					self._merge(shelf, key, delta)
+
+	def record(self, roll, user, channel):
+		"""Add every die in an evaluated roll to its user's and channel's stats"""
+		faces = list(roll.faces())
+		if not faces:
+			return
+
+		for key in (f"user {user.id}", f"channel {channel.id}"):
+			scope = self.get(key)
+			delta = self._deltas.setdefault(key, {})
+			for name, low, sides, counts in faces:
+				for stats_dict in (scope, delta):
+					stats = stats_dict.get(name)
+					if stats is None or stats.sides != sides:
+						stats = stats_dict[name] = DieStats(low, sides)
+					stats.add(counts)
+
+		# in case the flushing task isn't running
+		if self._task is None and monotonic() - self._flushed >= self._interval:
+			self.flush()
+
+	@staticmethod
+	def _merge(shelf, key, delta):
+		"""Merge one scope's additions into the store, returning the merged scope"""
+		scope = shelf[key] if key in shelf else {}
+		for name, stats in delta.items():
+			old = scope.get(name)
+			if old is None or old.sides != stats.sides:
+				scope[name] = stats
+			else:
+				old.merge(stats)
+		shelf[key] = scope
+		return scope
+
+	def flush(self):
+		"""Merge what's been rolled since the last flush into the store"""
+		if self._deltas:
+			with self._store.open(self._namespace) as shelf:
+				for key, delta in self._deltas.items():
+					# pick up what other processes have added, too
+					self._scopes[key] = self._merge(shelf, key, delta)
+			self._deltas = {}
+		self._flushed = monotonic()
+
+	def start(self, loop):
+		"""Flush every "interval" seconds on the given loop, so quiet scopes are written too"""
+		if self._task is None:
+			self._task = loop.create_task(self._flush_periodically())
+
+	async def _flush_periodically(self):
+		while True:
+			await asyncio.sleep(self._interval)
+			try:
+				self.flush()
+			except Exception as e:
+				print("Could not flush roll stats:", repr(e))
+
+	def stop(self):
+		"""Stop flushing on a timer, and flush whatever's left"""
+		if self._task is not None:
+			self._task.cancel()
+			self._task = None
+		self.flush()
@@ -0,0 +1,196 @@
+from collections.abc import MutableMapping
+from pathlib import Path
+import dbm
+import json
+import os
+import pickle
+import shelve
+import sqlite3
+import threading
+
+class Namespace(MutableMapping):
+	"""
+	One namespace of a Store, used like a shelf. Values are pickled, so as
+	with shelve, changing a value read from it means assigning it back.
+	"""
+	def __init__(self, connection, name):
+		self._db = connection
+		self._name = name
+		self._changed = False
+
+	def __getitem__(self, key):
+		row = self._db.execute(
+			"SELECT value FROM items WHERE namespace = ? AND key = ?", (self._name, key)
+		).fetchone()
+		if row is None:
+			raise KeyError(key)
+		return pickle.loads(row[0])
+
+	def __setitem__(self, key, value):
+		self._db.execute(
+			"INSERT OR REPLACE INTO items VALUES (?, ?, ?)",
+			(self._name, key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+		)
+		self._changed = True
+
+	def __delitem__(self, key):
+		cursor = self._db.execute("DELETE FROM items WHERE namespace = ? AND key = ?", (self._name, key))
+		if not cursor.rowcount:
+			raise KeyError(key)
+		self._changed = True
+
+	def __contains__(self, key):
+		return self._db.execute(
+			"SELECT 1 FROM items WHERE namespace = ? AND key = ?", (self._name, key)
+		).fetchone() is not None
+
+	def __iter__(self):
+		rows = self._db.execute("SELECT key FROM items WHERE namespace = ?", (self._name,))
+		return iter([key for key, in rows])
+
+	def __len__(self):
+		return self._db.execute("SELECT COUNT(*) FROM items WHERE namespace = ?", (self._name,)).fetchone()[0]
+
+	def get_many(self, keys):
+		"""Get whichever of some keys exist, as a dict, in one query"""
+		keys = list(keys)
+		rows = self._db.execute(
+			f"SELECT key, value FROM items WHERE namespace = ? AND key IN ({', '.join('?' * len(keys))})",
+			(self._name, *keys)
+		)
+		return {key: pickle.loads(value) for key, value in rows}
+
+	def prefixed(self, prefix: str):
+		"""Get every key starting with a prefix, without reading any values"""
+		# a range over the primary key, so only the matching keys are visited
+		end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+		rows = self._db.execute(
+			"SELECT key FROM items WHERE namespace = ? AND key >= ? AND key < ?", (self._name, prefix, end)
+		)
+		return [key for key, in rows]
+
+	def __enter__(self):
+		# taking the write lock up front makes every read-modify-write atomic
+		self._db.execute("BEGIN IMMEDIATE")
+		return self
+
+	def __exit__(self, kind, value, traceback):
+		if kind is not None:
+			self._db.execute("ROLLBACK")
+			return
+		if self._changed:
+			self._db.execute(
+				"INSERT INTO versions VALUES (?, 1) ON CONFLICT(namespace) DO UPDATE SET version = version + 1",
+				(self._name,)
+			)
+		self._db.execute("COMMIT")
+
+class Store:
+	"""
+	Storage shared by every process of the bot, kept in one SQLite database.
+	It's split into namespaces that each work like a shelf. Every change to a
+	namespace bumps its version, which is how other processes notice it.
+	"""
+	def __init__(self, path):
+		self._path = path
+		# connections can't cross a fork or a thread, so each process, and each thread, opens its own
+		self._local = threading.local()
+
+	def _connect(self):
+		local = self._local
+		if getattr(local, "pid", None) != os.getpid():
+			self._path.parent.mkdir(parents = True, exist_ok = True)
+			db = sqlite3.connect(self._path, timeout = 10.0, isolation_level = None)
+			# readers never wait on the writer, and writers wait their turn
+			db.execute("PRAGMA journal_mode = WAL")
+			db.execute("PRAGMA synchronous = NORMAL")
+			db.execute("CREATE TABLE IF NOT EXISTS items (namespace TEXT, key TEXT, value BLOB, PRIMARY KEY (namespace, key))")
+			db.execute("CREATE TABLE IF NOT EXISTS versions (namespace TEXT PRIMARY KEY, version INTEGER)")
+			db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+			local.connection = db
+			local.pid = os.getpid()
+		return local.connection
+
+	def open(self, namespace: str):
+		"""Open a namespace, as a context manager holding the write lock until it exits"""
+		return Namespace(self._connect(), namespace)
+
+	def version(self, namespace: str):
+		"""Get how many times a namespace has been changed, by any process"""
+		row = self._connect().execute("SELECT version FROM versions WHERE namespace = ?", (namespace,)).fetchone()
+		return 0 if row is None else row[0]
+
+	def reserve(self, name: str, count: int, floor: int = 1):
+		"""Take the next "count" values of a shared counter, returning the first"""
+		db = self._connect()
+		db.execute("BEGIN IMMEDIATE")
+		try:
+			row = db.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+			first = max(floor, 1 if row is None else row[0])
+			db.execute("INSERT OR REPLACE INTO counters VALUES (?, ?)", (name, first + count))
+		except:
+			db.execute("ROLLBACK")
+			raise
+		db.execute("COMMIT")
+		return first
+
+	def snapshot(self, namespace: str):
+		"""Read a whole namespace at once, as its version and a dict of its contents"""
+		db = self._connect()
+		# a read transaction sees one consistent version of the database
+		db.execute("BEGIN")
+		try:
+			row = db.execute("SELECT version FROM versions WHERE namespace = ?", (namespace,)).fetchone()
+			rows = db.execute("SELECT key, value FROM items WHERE namespace = ?", (namespace,)).fetchall()
+		finally:
+			db.execute("COMMIT")
+		return (0 if row is None else row[0]), {key: pickle.loads(value) for key, value in rows}
+
+	def import_shelf(self, namespace: str, path: Path):
+		"""Copy an old shelve file into a namespace, if the namespace is still empty"""
+		try:
+			shelf = shelve.open(str(path), "r")
+		except dbm.error:
+			return
+		with shelf, self.open(namespace) as target:
+			if len(target):
+				return
+			for key in shelf:
+				target[key] = shelf[key]
+
+	def import_json(self, namespace: str, path: Path):
+		"""Replace a namespace with the top level of a JSON file, if the file exists"""
+		try:
+			with open(path, "r") as file:
+				data = json.load(file)
+		except FileNotFoundError:
+			return
+		with self.open(namespace) as target:
+			target.clear()
+			for key, value in data.items():
+				target[key] = value
+
+class StoreView:
+	"""A cached, read-only copy of a namespace, reloaded whenever any process changes it"""
+	def __init__(self, store: Store, namespace: str):
+		self._store = store
+		self._namespace = namespace
+		self._version = None
+		self._data = None
+
+	def _refresh(self):
+		if self._store.version(self._namespace) != self._version:
+			self._version, self._data = self._store.snapshot(self._namespace)
+
+	def load(self):
+		"""Get the current data, reloading it if it's been changed"""
+		self._refresh()
+		return self._data
+
+	def __getitem__(self, item):
+		self._refresh()
+		return self._data[item]
+
+	def __getattr__(self, attr):
+		self._refresh()
+		return getattr(self._data, attr)
@@ -1,12 +1,13 @@
 import json
 from typing import Optional
-from random import shuffle
 import re
 
 from discord.ext import commands as cmds
 from discord import Embed, Color
 
-from .modules.misc import TimerConverter, Timer
+from .modules.misc import TimerConverter, Timer, Shuffle
+from .modules.pages import Paginator
+from .modules.outbox import outbox
 from .modules.configs import color_config as colcon
 
 class Other(cmds.Cog):
@@ -28,9 +29,12 @@ class Other(cmds.Cog):
 
 		# send msg, wait for timer to run, then send complete message
 		await ctx.send(startmsg)
-		status = await timer.start(tid)
+		# the timer belongs to this channel's shard, which only this process runs
+		shard = ctx.guild.shard_id if ctx.guild is not None else 0
+		status = await timer.start(tid, shard)
 		if status:
-			await ctx.send(endmsg)
+			# timers often end together, so this goes out with any others ending now
+			await outbox.send(ctx.channel, endmsg)
 
 	@timer.command(name="status", aliases=["show"], brief="show timer status")
 	async def timer_status(self, ctx, *, tag: Optional[str] = ""):
@@ -61,6 +65,16 @@ class Other(cmds.Cog):
 		tstr = f" \"{tag}\"" if tag else ""
 		await ctx.send(f"Timer{tstr} stopped with {existing.remaining} remaining")
 
+	def _parse_shuffle(self, choices):
+		"""Turn choices in the form "thingXnum" into a Shuffle"""
+		counts = []
+		for c in choices:
+			# split all in the form thingXnum
+			base, mult = re.match(r"(.*?)(?:x(\d+))?$", c, flags=re.I).groups()
+			# int(mult), or 1 if mult is None
+			counts.append((base, int(mult or 1)))
+		return Shuffle(counts)
+
 	@cmds.command(aliases=["shuff", "shuf", "sh"], brief="shuffle a list")
 	async def shuffle(self, ctx, *choices: str):
 		"""
@@ -71,21 +85,35 @@ class Other(cmds.Cog):
 		- "X" isn't case sensitive
 		- The number must be positive
 		- Multi-word names can be accomplished by surrounding the whole choice in quotes (e.g. "Death Bladex4" would put four "Death Blade"s on the list). This includes the "Xnum" part.
+		- Long lists are split into pages. For very long lists, see the "shufflesummary" command
 		"""
-		final = []
-		for c in choices:
-			# split all in the form thingXnum 
-			base, mult = re.match(r"(.*?)(?:x(\d+))?$", c, flags=re.I).groups()
-			# int(mult), or 1 if mult is None
-			mult = int(mult or 1)
-			for _ in range(mult):
-				final.append(base)
-
-		shuffle(final)
-		ebd = Embed(
-			color = Color.from_rgb(*colcon["shuffle"]),
-			title = "Your shuffled list is:",
-			description = "\n".join(final)
-		)
-
-		await ctx.send(embed=ebd)
+		final = self._parse_shuffle(choices)
+		def build(page):
+			return Embed(
+				color = Color.from_rgb(*colcon["shuffle"]),
+				title = "Your shuffled list is:",
+				description = "\n".join(page)
+			)
+
+		await Paginator(lambda: iter(final), build).send(ctx)
+
+	# a separate command, so no list's first item is ever taken for a subcommand
+	@cmds.command(name="shufflesummary", aliases=["shuffsum"], brief="shuffle a list, grouping repeats")
+	async def shuffle_summary(self, ctx, *choices: str):
+		"""
+		The same as the shuffle command, except that items which land next to each other are grouped together.
+		For example, three "villain"s in a row would be shown once as "villain x3".
+		"""
+		final = self._parse_shuffle(choices)
+		def rows():
+			for item, count in final.runs():
+				yield item if count == 1 else f"{item} x{count}"
+
+		def build(page):
+			return Embed(
+				color = Color.from_rgb(*colcon["shuffle"]),
+				title = f"Your shuffled list of {len(final)} is:",
+				description = "\n".join(page)
+			)
+
+		await Paginator(rows, build).send(ctx)
@@ -1,31 +1,80 @@
 from collections import Counter
 from datetime import datetime
+from functools import partial
 from typing import Optional, Union
+import asyncio
 import json
 import os
 import random
 import re
-import shelve
 
 from discord.ext import commands as cmds
-import discord.utils as utils
-from discord import Embed, Color
-
-from .modules.dice import TokenConverter, PresetConverter, PresetConverterError, Roll
+from discord import Embed, Color, HTTPException, NotFound
+
+from puckdice import Offloader, TooExpensiveError
+
+from .modules.emoji import EmojiIndex
+from .modules.pages import Paginator, shorten
+from .modules.stats import RollStats
+from .modules.audit import RollLog
+from .modules.memory import MemberCache
+from .modules.limits import limiter, coalesce, RateLimited
+from .modules.outbox import outbox
+from .modules.cards import CardRelay
+from .modules.dice import TokenConverter, PresetConverter, PresetConverterError, ParseError, Token, Roll, Batch
+from .modules.presets import preset_graph, PresetExpansionError
 from .modules.configs import color_config as colcon
-from .modules.configs import dice_config as dcon
-from .modules.configs import rolls_config as rcon
+from .modules.configs import dice_model as dmod
+from .modules.configs import xcard_config as xcon
+from .modules.configs import memory_config as mcon
+from .modules.configs import store, cluster, clusters
 
 class RPG(cmds.Cog):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 		self._force_points = {}
+		self._emoji = EmojiIndex()
+		self._offload = Offloader()
+		self._stats = RollStats(store, size = mcon["stats"])
+		self._log = RollLog(store, cluster)
+		# who's in which guild, for guilds whose members aren't cached
+		self.members = MemberCache(mcon["members"], mcon["member_ttl"])
+		# how many members can be looked up at once, so a card can't flood discord with requests
+		self._fetches = asyncio.Semaphore(mcon["fetches"])
+		# prefix -> the messages of the roll docs
+		self._docs = {}
+		# guild id -> (dice model, emoji index, page embeds) of the special dice docs
+		self._sdocs = {}
+		# cards for the guilds on other processes, and this process's from theirs, if there are others
+		self._cards = CardRelay(store, cluster) if clusters > 1 else None
+		self._relay = None
+
+	def start(self, bot):
+		"""Start the background work: writing out stats, and announcing cards sent to other processes"""
+		self._stats.start(bot.loop)
+		if self._cards is not None and self._relay is None:
+			self._relay = bot.loop.create_task(self._cards.run(partial(self._announce, bot)))
+
+	def cog_unload(self):
+		if self._relay is not None:
+			self._relay.cancel()
+		self._offload.close()
+		self._stats.stop()
+		self._log.close()
+
+	@cmds.Cog.listener()
+	async def on_guild_emojis_update(self, guild, before, after):
+		self._emoji.update(guild, after)
+		self._sdocs.pop(guild.id, None)
+
+	@cmds.Cog.listener()
+	async def on_guild_remove(self, guild):
+		self._emoji.discard(guild)
+		self.members.discard_guild(guild.id)
+		self._sdocs.pop(guild.id, None)
+
 	def _parse_emoji(self, ctx, text):
-		for name in set(re.findall(r":(\w+?):", text)):
-			emoji = utils.get(ctx.guild.emojis, name=name)
-			if emoji is None: continue
-			text = text.replace(f":{name}:", str(emoji))
-		return text
+		return self._emoji.substitute(ctx.guild, text)
 
 	def _gencard(self, cardtype, tag = ""):
 		"""Generates the message and embed for an x- or o-card invoke"""
@@ -43,29 +92,71 @@ class RPG(cmds.Cog):
 
 		return ("@here", Embed(color = color, title = title, description = desc))
 
-	async def _getshared(self, ctx):
-		"""Gets a list of xcard channels shared by the ctx.author and the bot"""
+	async def _getshared(self, bot, uid):
+		"""Gets a list of xcard channels shared by a user and this process of the bot"""
+
+		async def shares(guild):
+			# a member cache hit answers without any requests, and a fully
+			# chunked guild's cache is complete, so a miss there means no
+			if guild.get_member(uid) is not None:
+				return True
+			if guild.chunked:
+				return False
+			known = self.members.get(guild.id, uid)
+			if known is not None:
+				return known
+			try:
+				async with self._fetches:
+					isshared = await guild.fetch_member(uid) is not None
+			except NotFound:
+				isshared = False
+			except HTTPException:
+				# don't remember a failed request as an answer
+				return False
+			self.members.put(guild.id, uid, isshared)
+			return isshared
+
+		guilds = bot.guilds
+		shared = await asyncio.gather(*map(shares, guilds))
+		# read once, rather than checking the store for changes once per guild
+		xcards = xcon.load()
+
 		channels = []
-		with open("./data/xcard.json", "r") as file:
-			data = json.load(file)
-		# for any guild the bot is in
-		for guild in ctx.bot.guilds:
+		for guild, isshared in zip(guilds, shared):
 			# skip any guild the sender isn't in
-			if not await guild.fetch_member(ctx.author.id):
+			if not isshared:
 				continue
 
 			# find the channel in any shared guilds to send msg to
-			if str(guild.id) in data and "general" in data[str(guild.id)]:
+			data = xcards.get(str(guild.id), {})
+			if "general" in data:
 				# if a bot spam channel has been set, send it there
-				channel_id = int(data[str(guild.id)]["general"])
-				channels.append(guild.get_channel(channel_id))
+				channels.append(guild.get_channel(int(data["general"])))
 			else:
 				# otherwise, send it to the system channel
 				syschan = guild.system_channel
 				# last ditch, send it to the first channel listed
-				channels.append(syschan or guild.text_channels[0])
+				channels.append(syschan or next(iter(guild.text_channels), None))
+
+		# drop any channels that have since been deleted
+		return [c for c in channels if c is not None]
 
-		return channels
+	async def _sendall(self, channels, *args, **kwargs):
+		"""Send the same message to every channel at once, so one failure can't stop the rest"""
+		sends = (outbox.send(channel, *args, **kwargs) for channel in channels)
+		for channel, result in zip(channels, await asyncio.gather(*sends, return_exceptions=True)):
+			if isinstance(result, Exception):
+				print(f"Could not send to channel {channel.id}:", result)
+
+	@staticmethod
+	def _profiling(ctx):
+		"""Whether a command is being profiled, so its dice should be rolled where the profiler can see them"""
+		return getattr(ctx, "profiling", False)
+
+	async def _limited(self, ctx, error):
+		"""Tell a user their roll was rate limited, once until the limit wears off"""
+		if limiter.should_warn(ctx, error):
+			await ctx.send(str(error))
 
 	@cmds.group(aliases=["r"], brief="Roll some dice", invoke_without_command=True)
 	async def roll(self, ctx, preset: Optional[PresetConverter] = [], *, roll: Optional[TokenConverter] = []):
@@ -73,40 +164,173 @@ class RPG(cmds.Cog):
 		Roll some number of dice with potential modifiers.
 		The documentation for this command is quite long, detailing exactly what can and cannot be supplied as an argument. As such, it has been moved to the "roll docs" subcommand. Either call that command, or call the help command on it to read the documentation. Please consider doing so in direct messages with me if you wish not to have long messages in this channel.
 		"""
-		# convert arguments to a Roll object
-		roll = Roll(preset + roll)
-
-		# call evaluate to apply all modifiers
-		roll.evaluate()
+		# a leading "Nx" means this is really a batch
+		tokens = preset + roll
+		if tokens and tokens[0].name == "repeat":
+			await self._send_batch(ctx, Batch(tokens))
+			return
 
-		# create all the strings to be used in the embed
-		title = f"Rolling \"{roll.raw}\"" if roll.tag is None else roll.tag.as_tag()
-		results = "".join(f"\n{b.invoke}: {b.result}" for b in roll.bases)
-		totals = ", ".join(roll.totals) or "No dice rolled"
+		# convert arguments to a Roll object, then call evaluate to
+		# apply all modifiers, in another process if it's expensive
+		try:
+			roll = Roll(tokens)
+			# the command itself was charged for already, this is for the dice
+			await limiter.charge(ctx, limiter.weight(roll.cost))
+			roll = await self._offload.evaluate(roll, inline = self._profiling(ctx))
+		except (ParseError, TooExpensiveError) as e:
+			await ctx.send(str(e))
+			return
+		except RateLimited as e:
+			await self._limited(ctx, e)
+			return
+		self._stats.record(roll, ctx.author, ctx.channel)
+		rid = self._log.append(ctx.author.id, ctx.channel.id, roll.seed, 1, roll.tokens, roll.totals)
+		await self._show_roll(ctx, roll, f"Roll #{rid}")
+
+	async def _show_roll(self, ctx, roll, footer):
+		"""Send an evaluated Roll"""
+		# create all the strings to be used in the embed, with
+		# special dice rendered straight to this guild's emoji
+		symbols = partial(self._emoji.table, ctx.guild)
+		title = f"Rolling \"{roll.raw}\"" if roll.tag is None else roll.tag
+		totals = ", ".join(roll.render_totals(symbols)) or "No dice rolled"
 		plural = "" if len(roll.bases) == 1 else "s"
 
-		# check if the roll is hidden
-		if roll.hidden:
-			results = "[REDACTED]"
+		# fields have a length limit, so cut off any overly long totals
+		totals = shorten(totals, 1024)
+
+		# the results are only rendered a page at a time, as they're shown
+		def rows():
+			# check if the roll is hidden
+			if roll.hidden:
+				return iter(["[REDACTED]"])
+			return ("{}: {}".format(*b.render(symbols)) for b in roll.bases)
 
 		# create the embed and add the values
-		ebd = Embed(
-			color = Color.from_rgb(*colcon["roll"]),
-			title = self._parse_emoji(ctx, title),
-		).add_field(
-			name = f"Result{plural}:",
-			value = self._parse_emoji(ctx, results),
-			inline = False
-		).add_field(
-			name = f"Total{plural}:",
-			value = self._parse_emoji(ctx, totals),
-			inline = False
-		)
+		def build(page):
+			return Embed(
+				color = Color.from_rgb(*colcon["roll"]),
+				# titles have a length limit too, which a long tag can pass
+				title = shorten(self._parse_emoji(ctx, title), 256),
+			).add_field(
+				name = f"Result{plural}:",
+				value = "\n".join(page),
+				inline = False
+			).add_field(
+				name = f"Total{plural}:",
+				value = totals,
+				inline = False
+			).set_footer(text = footer)
 
 		# and send
-		await ctx.send(embed=ebd)
+		await Paginator(rows, build, limit = 1024).send(ctx)
+
+	async def _send_batch(self, ctx, batch):
+		"""Evaluate a Batch and send every roll's totals in one embed"""
+		if not 0 < batch.count <= batch.max_count:
+			await ctx.send(f"I can only roll between 1 and {batch.max_count} times at once.")
+			return
+
+		try:
+			await limiter.charge(ctx, limiter.weight(batch.cost))
+			batch = await self._offload.evaluate(batch, inline = self._profiling(ctx))
+		except (ParseError, TooExpensiveError) as e:
+			await ctx.send(str(e))
+			return
+		except RateLimited as e:
+			await self._limited(ctx, e)
+			return
+		for roll in batch.rolls:
+			self._stats.record(roll, ctx.author, ctx.channel)
+		results = [roll.totals for roll in batch.rolls]
+		rid = self._log.append(ctx.author.id, ctx.channel.id, batch.seed, batch.count, batch.tokens, results)
+		await self._show_batch(ctx, batch, f"Roll #{rid}")
+
+	async def _show_batch(self, ctx, batch, footer):
+		"""Send an evaluated Batch"""
+		# one row of totals per roll, special dice rendered to this guild's emoji
+		symbols = partial(self._emoji.table, ctx.guild)
+		def rows():
+			for i, roll in enumerate(batch.rolls, 1):
+				totals = ", ".join(roll.render_totals(symbols)) or "No dice rolled"
+				yield f"**{i}**: {totals}"
+
+		# then summarize the numeric totals and any passes
+		stats = []
+		if batch.stats is not None:
+			total, mean, low, high = batch.stats
+			stats.append(f"Sum: {total}, Mean: {mean:.2f}, Min: {low}, Max: {high}")
+		if batch.successes is not None:
+			stats.append(f"Successes: {batch.successes}/{batch.count}")
+
+		first = batch.rolls[0]
+		title = f"Rolling \"{batch.raw}\"" if first.tag is None else first.tag
+		title = shorten(self._parse_emoji(ctx, f"{title} ({batch.count} times)"), 256)
+		def build(page):
+			ebd = Embed(
+				color = Color.from_rgb(*colcon["roll"]),
+				title = title,
+				description = "\n".join(page)
+			)
+			if stats:
+				ebd.add_field(name = "Statistics:", value = "\n".join(stats), inline = False)
+			return ebd.set_footer(text = footer)
+
+		await Paginator(rows, build).send(ctx)
+
+	@roll.command(name="batch", aliases=["b", "many"], brief="roll the same thing many times")
+	async def roll_batch(self, ctx, count: int, preset: Optional[PresetConverter] = [], *, roll: Optional[TokenConverter] = []):
+		"""
+		Roll the same thing several times, showing every total in one message along with some statistics.
+		For example, "roll batch 6 4d6 max 3 subtotal" rolls a full array of ability scores.
+		This can also be done by starting a roll with "Nx", as in "roll 6x 4d6 max 3 subtotal".
+		"""
+		await self._send_batch(ctx, Batch(preset + roll, count))
+
+	@roll.command(name="replay", aliases=["re"], brief="replay a past roll exactly")
+	async def roll_replay(self, ctx, rid: int):
+		"""
+		Make a past roll again from the log, using the same dice it was rolled with, to settle any disputes about it.
+		Every roll's number is shown at the bottom of its results. The replay says whether it matches what was originally rolled, which it won't if the special dice have changed since.
+		Only rolls made in this channel, or made by you, can be replayed.
+		"""
+		record = await self._log.find(rid)
+		# only the roller, or the channel it was rolled in, gets to see it again
+		if record is None or (record.channel != ctx.channel.id and record.user != ctx.author.id):
+			await ctx.send(f"There's no roll #{rid}.")
+			return
+
+		tokens = [Token(name, raw, tuple(args), subname) for name, raw, args, subname in record.tokens]
+		if record.count == 1:
+			item = Roll(tokens)
+		else:
+			item = Batch(tokens, record.count)
+		item.seed = record.seed
+
+		try:
+			await limiter.charge(ctx, limiter.weight(item.cost))
+			item = await self._offload.evaluate(item, inline = self._profiling(ctx))
+		except (ParseError, TooExpensiveError) as e:
+			await ctx.send(str(e))
+			return
+		except RateLimited as e:
+			await self._limited(ctx, e)
+			return
+
+		when = datetime.fromtimestamp(record.time).strftime("%Y-%m-%d %H:%M:%S")
+		if record.count == 1:
+			matches = item.totals == record.results
+		else:
+			matches = [roll.totals for roll in item.rolls] == record.results
+		footer = f"Replay of roll #{rid}, made {when}, which it {'matches' if matches else 'does not match'}"
+
+		if record.count == 1:
+			await self._show_roll(ctx, item, footer)
+		else:
+			await self._show_batch(ctx, item, footer)
 
 	@roll.command(name="docs", aliases=["doc"], brief="docs for the roll command")
+	@coalesce(read_only = True)
 	async def roll_docs(self, ctx):
 		"""
 		Roll some number of dice with potential modifiers.
@@ -137,6 +361,8 @@ class RPG(cmds.Cog):
 
 		Any entry not matching one of the above types is considered a tag. All tags will be put together and displayed at the top of the response.
 
+		Starting a roll with "Nx", where N is a number, will make that whole roll N times. Only the totals of each are shown, followed by some statistics about them. The "batch" subcommand does the same thing.
+
 		Examples:
 		2d6 : roll two six sided dice.
 		d6 : roll one six sided dice (the first value defaults to 1).
@@ -154,39 +380,116 @@ class RPG(cmds.Cog):
 		2d6 >=3 num : this is invalid, since there are spaces between the dice and the modifiers.
 		"2d6 >=3 num" : this is valid, because the whole roll is surrounded by quotes ("").
 		"2d6 >= 3 num" : spaces may also occur between modifiers and their values when quoted.
+		6x 4d6max3 : roll 4d6max3 six separate times, showing each total and their statistics.
 
 		To see what special dice are available, see the "sdocs" subcommand.
 		"""
-		await ctx.send_help(ctx.command)
+		# laid out as the help command would, but only once
+		pages = self._docs.get(ctx.prefix)
+		if pages is None:
+			command = ctx.command
+			paginator = cmds.Paginator()
+			names = "|".join((command.name, *command.aliases))
+			paginator.add_line(f"{ctx.prefix}{command.full_parent_name} [{names}]", empty = True)
+			for line in command.help.splitlines():
+				paginator.add_line(line)
+			pages = self._docs[ctx.prefix] = paginator.pages
+
+		for page in pages:
+			await ctx.send(page)
 
 	@roll.command(name="sdocs", aliases=["sdoc"], brief="docs for special dice")
+	@coalesce(read_only = True)
 	async def roll_sdocs(self, ctx):
 		"""
 		Since which special dice are available can change, but this documentation cannot, please call this command to see what they currently are.
 		"""
-		ebd = Embed(
-			color = Color.from_rgb(*colcon["roll"]),
-			title = self._parse_emoji(ctx, "Available special dice"),
-			description = "Each category will say what it is, then what the delimiter is (the \"d\" in \"XdY\"), then will have a list of possible dice in that category. Each dice will show its name, then will list the possible options for \"Y\" that will roll that dice. Frequently this will include longer versions, as well as shorter aliases."
-		)
+		# rendered once per guild, until the dice config or the guild's emoji change
+		model = dmod.load()
+		index = self._emoji.get(ctx.guild)
+		key = ctx.guild and ctx.guild.id
+		cached = self._sdocs.get(key)
+		if cached and cached[0] is model and cached[1] is index:
+			await Paginator.rendered(cached[2]).send(ctx)
+			return
 
-		for category, data in dcon.items():
-			title = f"{category} : {data['delimiter']}"
-			desc = {}
-			for name in data["faces"].keys():
-				desc[name] = data["aliases"][name]
+		def rows():
+			for category in model.values():
+				title = f"{category.name} : {category.delimiter}"
+				table = self._emoji.table(ctx.guild, category)
+				values = []
+				for name in category.dice:
+					display = table[category.symbol_ids[name]]
+					values.append(f"{display}: {', '.join(category.die_aliases[name])}")
+				yield title, "\n".join(values)
+
+		def build(page):
+			ebd = Embed(
+				color = Color.from_rgb(*colcon["roll"]),
+				title = self._parse_emoji(ctx, "Available special dice"),
+				description = "Each category will say what it is, then what the delimiter is (the \"d\" in \"XdY\"), then will have a list of possible dice in that category. Each dice will show its name, then will list the possible options for \"Y\" that will roll that dice. Frequently this will include longer versions, as well as shorter aliases."
+			)
+			for name, value in page:
+				ebd.add_field(name = name, value = value, inline = False)
+			return ebd
+
+		# embeds can have at most 25 fields, and 6000 characters in total
+		pages = Paginator(
+			rows,
+			build,
+			limit = 5000,
+			max_rows = 25,
+			size = lambda field: len(field[0]) + len(field[1])
+		).pages()
+		self._sdocs[key] = (model, index, pages)
+		await Paginator.rendered(pages).send(ctx)
+
+	def _luck_embed(self, ctx, title, key):
+		"""Build an embed summarizing the die stats of a scope"""
+		ebd = Embed(color = Color.from_rgb(*colcon["roll"]), title = title)
+		scope = self._stats.get(key)
+		# embeds can have at most 25 fields, so show the most rolled dice
+		for name, stats in sorted(scope.items(), key=lambda i: -i[1].count)[:25]:
+			lines = [f"Rolled {stats.count} times"]
+			if stats.mean is not None:
+				lines.append(f"Mean {stats.mean:.2f} (fair is {stats.fair_mean:.2f}), deviation {stats.deviation:.2f}")
+
+			zscore = stats.zscore
+			uniformity = stats.uniformity
+			if uniformity is not None:
+				lines.append(f"Chi-square {stats.chi_square:.1f}, p = {uniformity:.3f}")
+			if zscore is not None and zscore >= 2:
+				lines.append("These dice are **blessed**.")
+			elif zscore is not None and zscore <= -2:
+				lines.append("These dice are **cursed**.")
+			elif uniformity is not None and uniformity < 0.01:
+				lines.append("These dice are **suspiciously uneven**.")
+			else:
+				lines.append("These dice look fair.")
 
-			values = []
-			for name, aliases in desc.items():
-				values.append(f"{name}: {', '.join(aliases)}")
+			ebd.add_field(name = self._parse_emoji(ctx, name), value = "\n".join(lines), inline = False)
 
-			ebd.add_field(
-				name = self._parse_emoji(ctx, title),
-				value = self._parse_emoji(ctx, "\n".join(values)),
-				inline = False
-			)
+		if not scope:
+			ebd.description = "No dice rolled yet."
+		return ebd
+
+	@roll.group(name="luck", aliases=["l"], brief="are your dice cursed?", invoke_without_command=True)
+	@coalesce(read_only = True, per_user = True)
+	async def roll_luck(self, ctx, user: Optional[cmds.MemberConverter] = None):
+		"""
+		Show how every kind of die you've rolled has treated you, compared to a fair die.
+		The mean is compared with that of a fair die to decide whether the dice are blessed or cursed, and the chi-square test checks whether every face comes up about as often as it should.
+		Optionally you can specify a user, to see how their dice have treated them instead.
+		"""
+		user = user or ctx.author
+		await ctx.send(embed = self._luck_embed(ctx, f"The luck of {user.name}", f"user {user.id}"))
 
-		await ctx.send(embed=ebd)
+	@roll_luck.command(name="channel", aliases=["c"], brief="are this channel's dice cursed?")
+	@coalesce(read_only = True)
+	async def roll_luck_channel(self, ctx):
+		"""Show how every kind of die rolled in this channel has treated everyone here."""
+		title = f"The luck of #{getattr(ctx.channel, 'name', 'this channel')}"
+		await ctx.send(embed = self._luck_embed(ctx, title, f"channel {ctx.channel.id}"))
 
 	@roll.group(name="preset", aliases=["pset", "p"], brief="view and create presets", invoke_without_command=True)
 	async def roll_preset(
@@ -199,13 +502,16 @@ class RPG(cmds.Cog):
 		):
 		"""
 		This command is used to view your presets, as well as create new ones.
-		When used without arguments, it will list all the possible presets you can use here, including channel-specific and global ones.
+		When used without arguments, it will list all the possible presets you can use here, including channel, server, and global ones.
 		When used with one argument, it will show you what that preset currently represents for you, i.e. what it would get replaced with when you try to use it in a roll.
 		When used with more arguments, it will create a new preset. The first argument is used as a name, and the rest are what thaa preset will be replaced with when used in a roll.
 		For example, calling "roll preset test 2d6 +1" means that a later roll of "roll test +3" will be treated as "roll 2d6 +1 +3".
+		Presets can use other presets, by writing "@name" for one copy of that preset, or "N@name" for N copies. For example, "roll preset stats 6@stat" rolls your "stat" preset six times over.
 
 		Optionally you can specify a user before any arguments, in which case any information returned will be that which pertains to that user.
 		No you can't set other people's presets, just view them.
+
+		Your presets come first, then this channel's, then this server's, then global ones. See the "--channel", "--server", and "--global" subcommands to manage those.
 		"""
 		uid = ctx.author.id
 		mention = ctx.author.mention
@@ -213,18 +519,9 @@ class RPG(cmds.Cog):
 			uid = user.id
 			mention = user.name
 		if name is None:
-			# strt with any global presets
-			ps = set(rcon.keys())
-			with shelve.open("data/presets.shelf") as shelf:
-				# check if there's presets for this channel
-				if "channel" in shelf and str(ctx.channel.id) in shelf["channel"]:
-					ps.update(shelf["channel"][str(ctx.channel.id)].keys())
-
-				# check if there's presets for this user
-				if "user" in shelf and str(uid) in shelf["user"]:
-					ps.update(shelf["user"][str(uid)].keys())
-
-			await ctx.send(f"The possible presets for {mention} in this channel are:\n" + ", ".join(ps))
+			# every scope's names, without reading any of the presets themselves
+			ps = preset_graph.names(preset_graph.scopes(ctx, uid))
+			await ctx.send(f"The possible presets for {mention} in this channel are:\n" + ", ".join(sorted(ps)))
 			return
 
 		if roll is None:
@@ -240,89 +537,165 @@ class RPG(cmds.Cog):
 					await ctx.send(f"That preset for {mention} here would roll \"{roll}\"")
 			return
 
-		name = name.lower()
-		with shelve.open("data/presets.shelf") as shelf:
-			if "user" not in shelf:
-				shelf["user"] = {}
-
-			# this and the "shelf["user"] = udict" below are
-			# to manage writing to mutable shelf entries
-			udict = shelf["user"]
-
-			uid = str(ctx.author.id)
-			if uid not in udict:
-				print("setting uid")
-				udict[uid] = {}
-
-			udict[uid][name] = roll
-			shelf["user"] = udict
-		await ctx.send("Preset set, try it out!")
+		await self._set_preset(ctx, ("user", ctx.author.id), name, roll)
 
 	@roll_preset.command(name="remove", aliases=["r"], brief="remove a user preset")
 	async def roll_preset_remove(self, ctx, name: str):
 		"""
 		This will clear the user preset for you with the given name.
-		Of note, this will not clear channel-specific or global presets.
+		Of note, this will not clear channel, server, or global presets.
 		"""
-		name = name.lower()
-		with shelve.open("data/presets.shelf") as shelf:
-			if "user" not in shelf:
-				shelf["user"] = {}
-
-			# this and the "shelf["user"] = udict" below are
-			# to manage writing to mutable shelf entries
-			udict = shelf["user"]
-
-			uid = str(ctx.author.id)
-			if uid not in udict or name not in udict[uid]:
-				await ctx.send("No such user preset defined for you.")
-				return
-
-			del udict[uid][name]
-			shelf["user"] = udict
+		await self._remove_preset(ctx, ("user", ctx.author.id), name)
+
+	async def _can_manage(self, ctx, kind):
+		"""Check whether the author may change a scope's presets, telling them if not"""
+		if kind == "global":
+			allowed = await ctx.bot.is_owner(ctx.author)
+		elif ctx.guild is None:
+			await ctx.send("Channel and server presets can only be set in a server.")
+			return False
+		elif kind == "channel":
+			allowed = ctx.channel.permissions_for(ctx.author).manage_channels
+		else:
+			allowed = ctx.author.guild_permissions.manage_guild
+
+		if not allowed:
+			who = {"channel": "people who can manage this channel", "guild": "people who can manage this server", "global": "my owner"}
+			await ctx.send(f"Only {who[kind]} can change those presets.")
+		return allowed
+
+	async def _set_preset(self, ctx, scope, name, roll):
+		if name.startswith("-"):
+			# those are left for the subcommands
+			await ctx.send("Preset names can't start with \"-\".")
+			return
+		if scope[0] != "user" and not await self._can_manage(ctx, scope[0]):
+			return
+		try:
+			preset_graph.set(scope, name.lower(), roll)
+		except PresetExpansionError as e:
+			await ctx.send(f"{e}\nPreset not set.")
+		else:
+			await ctx.send("Preset set, try it out!")
+
+	async def _remove_preset(self, ctx, scope, name):
+		if scope[0] != "user" and not await self._can_manage(ctx, scope[0]):
+			return
+		# the reply waits until the store is released, so other processes aren't kept waiting
+		if preset_graph.remove(scope, name.lower()):
 			await ctx.send("Preset removed.")
+		else:
+			await ctx.send("No such preset defined here.")
+
+	async def _scope_preset(self, ctx, scope, title, name, roll):
+		"""List, show, or set the presets of a single scope"""
+		if name is None:
+			ps = preset_graph.names((scope,))
+			await ctx.send(f"The {title} presets are:\n" + (", ".join(sorted(ps)) or "(none)"))
+		elif roll is None:
+			tokens = preset_graph.get(scope, name.lower())
+			if tokens is None:
+				await ctx.send(f"There's no {title} preset named \"{name}\"")
+			else:
+				await ctx.send(f"That {title} preset would roll \"{' '.join(t.raw.strip() for t in tokens)}\"")
+		else:
+			await self._set_preset(ctx, scope, name, roll)
+
+	# named like flags, as anything else could be the name of someone's preset
+	@roll_preset.group(name="--channel", brief="view and create channel presets", invoke_without_command=True)
+	async def roll_preset_channel(self, ctx, name: Optional[str] = None, *, roll: Optional[TokenConverter] = None):
+		"""
+		Works like the preset command, but for presets anyone can use in this channel.
+		Anyone can view them, but only people who can manage the channel can create them.
+		"""
+		await self._scope_preset(ctx, preset_graph.channel(ctx), "channel", name, roll)
+
+	@roll_preset_channel.command(name="remove", aliases=["r"], brief="remove a channel preset")
+	async def roll_preset_channel_remove(self, ctx, name: str):
+		"""This will clear the preset for this channel with the given name."""
+		await self._remove_preset(ctx, preset_graph.channel(ctx), name)
+
+	@roll_preset.group(name="--server", brief="view and create server presets", invoke_without_command=True)
+	@cmds.guild_only()
+	async def roll_preset_guild(self, ctx, name: Optional[str] = None, *, roll: Optional[TokenConverter] = None):
+		"""
+		Works like the preset command, but for presets anyone can use anywhere in this server.
+		Anyone can view them, but only people who can manage the server can create them.
+		"""
+		await self._scope_preset(ctx, ("guild", ctx.guild.id), "server", name, roll)
+
+	@roll_preset_guild.command(name="remove", aliases=["r"], brief="remove a server preset")
+	async def roll_preset_guild_remove(self, ctx, name: str):
+		"""This will clear the preset for this server with the given name."""
+		await self._remove_preset(ctx, ("guild", ctx.guild.id), name)
+
+	@roll_preset.group(name="--global", brief="view and create global presets", invoke_without_command=True)
+	async def roll_preset_global(self, ctx, name: Optional[str] = None, *, roll: Optional[TokenConverter] = None):
+		"""
+		Works like the preset command, but for presets anyone can use anywhere.
+		Anyone can view them, but only my owner can create them.
+		"""
+		await self._scope_preset(ctx, ("global",), "global", name, roll)
+
+	@roll_preset_global.command(name="remove", aliases=["r"], brief="remove a global preset")
+	async def roll_preset_global_remove(self, ctx, name: str):
+		"""
+		This will clear the global preset with the given name.
+		Global presets from the bot's configuration can't be removed this way.
+		"""
+		await self._remove_preset(ctx, ("global",), name)
 
 	@cmds.command(aliases=["x"], brief="Invoke the x-card")
 	async def xcard(self, ctx, *, tag: Optional[str] = ""):
 		"""
 		Invokes the x-card. The x-card is a device used to indicate that the current topic of conversation is making you uncomfortable. Please don't be embarrassed to use it, especially since it can be used anonymously (by sending the command to the bot in a direct message). It will send a message to the designated spam channel announcing that someone anonymous has invoked the x-card.
 		"""
-		msg, ebd = self._gencard("x", tag)
-		for channel in await self._getshared(ctx):
-			await channel.send(msg, embed = ebd)
+		await self._card(ctx, "x", tag)
 
 	@cmds.command(aliases=["o"], brief="Invoke the o-card")
 	async def ocard(self, ctx, *, tag: Optional[str] = ""):
 		"""
 		Invokes the o-card. This is the inverse of the x-card. Using this indicates that you're loving the current role-play, as an encouragement. This sends a message to the designated spam channel announcing that someone anonymous has invoked the o-card.
 		"""
-		msg, ebd = self._gencard("o", tag)
-		for channel in await self._getshared(ctx):
-			await channel.send(msg, embed = ebd)
+		await self._card(ctx, "o", tag)
+
+	async def _card(self, ctx, cardtype, tag):
+		"""Announce a card in every guild the user shares with the bot, on every process"""
+		await self._announce(ctx.bot, cardtype, tag, ctx.author.id)
+		if self._cards is not None:
+			# a write to the store, which can wait on other processes, so it's kept off the event loop
+			await ctx.bot.loop.run_in_executor(None, self._cards.post, cardtype, tag, ctx.author.id)
+
+	async def _announce(self, bot, cardtype, tag, uid):
+		"""Announce a card in the guilds on this process that the user shares with the bot"""
+		msg, ebd = self._gencard(cardtype, tag)
+		await self._sendall(await self._getshared(bot, uid), msg, embed = ebd)
 
 	async def _send_force_points(self, ctx, mod = None, new = None):
 		catid = ctx.channel.category_id
-		with shelve.open("data/sw.shelf") as shelf:
-			if "force points" not in shelf:
-				shelf["force points"] = {}
-			allpoints = shelf["force points"]
-
-		if catid not in allpoints:
-			allpoints[catid] = Counter({"light":0, "dark":0})
-		points = allpoints[catid]
-
-		if new is not None:
-			if new["light"] < 0 or new["dark"] < 0:
-				await ctx.send("Cannot set points below zero.\nPoints not adjusted.")
-			else:
-				points["light"] = new["light"]
-				points["dark"] = new["dark"]
+		error = None
+		# read, change, and write the points in one go, so no other process can change them in between
+		with store.open("sw") as shelf:
+			allpoints = shelf["force points"] if "force points" in shelf else {}
+
+			if catid not in allpoints:
+				allpoints[catid] = Counter({"light":0, "dark":0})
+			points = allpoints[catid]
+
+			if new is not None:
+				if new["light"] < 0 or new["dark"] < 0:
+					error = "Cannot set points below zero.\nPoints not adjusted."
+				else:
+					points["light"] = new["light"]
+					points["dark"] = new["dark"]
 
-		elif mod is not None:
-			if mod["light"] > points["light"] or mod["dark"] > points["dark"]:
-				await ctx.send("Points cannot go below zero.\nPoints not adjusted.")
-			else:
-				points.update(mod)
+			elif mod is not None:
+				if mod["light"] > points["light"] or mod["dark"] > points["dark"]:
+					error = "Points cannot go below zero.\nPoints not adjusted."
+				else:
+					points.update(mod)
+
+			shelf["force points"] = allpoints
 
 		lsebd = Embed(
 			title = f"Light side: {points['light']}",
@@ -333,11 +706,13 @@ class RPG(cmds.Cog):
 			color = Color.from_rgb(*colcon["darkside"])
 		)
 
-		await ctx.send(embed=lsebd)
-		await ctx.send(embed=dsebd)
-
-		with shelve.open("data/sw.shelf") as shelf:
-			shelf["force points"] = allpoints
+		# queued together and in order, so they can go out merged, and in that order
+		sends = []
+		if error is not None:
+			sends.append(outbox.post(ctx.channel, error))
+		sends.append(outbox.post(ctx.channel, embed=lsebd))
+		sends.append(outbox.post(ctx.channel, embed=dsebd))
+		await asyncio.gather(*sends)
 
 	@cmds.group(aliases=["sw"], brief="Starwars commands", invoke_without_command=True)
 	async def starwars(self, ctx):
@@ -0,0 +1,281 @@
+"""
+Offline load test for puck's commands.
+Sends stand-in messages through the bot's own command handling, as discord.py
+does for real ones, so every command goes through its converters, the global
+checks, the rate limiter and the metrics hooks. Only discord itself is stood
+in for, so nothing touches the network. The rate limits are raised out of
+reach unless --limits is given. Run "python loadtest.py --help".
+"""
+from itertools import count
+from pathlib import Path
+from random import Random
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from discord.ext import commands as cmds
+
+_root = Path(__file__).resolve().parent
+
+# a rough mix of what tables actually send
+_rolls = [
+	"d20 +5",
+	"d20 +7 Longsword attack",
+	"2d6 +3",
+	"4d6 max 3",
+	"2d20 max +4 advantage",
+	"8d10>=7 num",
+	"2d6x >=3 num",
+	"d100 success quiet <= 45",
+	"6x 4d6 max 3 subtotal",
+	"3swy 2swg 2swp 1swk",
+	"2swg 1swb 2swp",
+	"4sadv 2sc",
+	"4fate +2",
+]
+_ids = count(1000)
+
+class FakeEmoji:
+	def __init__(self, name):
+		self.name = name
+		self.id = next(_ids)
+
+	__str__ = lambda s: f"<:{s.name}:{s.id}>"
+
+class FakeUser:
+	def __init__(self):
+		self.id = next(_ids)
+		self.name = f"user{self.id}"
+		self.mention = f"<@{self.id}>"
+		self.bot = False
+
+class FakeMessage:
+	def __init__(self, channel, content = None, author = None):
+		self.id = next(_ids)
+		self.channel = channel
+		self.guild = channel.guild
+		self.content = content
+		self.author = author
+		# only used by the library to reach discord, which the context below doesn't
+		self._state = None
+
+	async def add_reaction(self, emoji):
+		await self.channel.delay()
+
+	async def remove_reaction(self, emoji, user):
+		await self.channel.delay()
+
+	async def clear_reactions(self):
+		await self.channel.delay()
+
+	async def edit(self, **kwargs):
+		await self.channel.delay()
+
+class FakeChannel:
+	def __init__(self, guild, latency):
+		self.id = next(_ids)
+		self.guild = guild
+		self.category_id = guild.id
+		self.latency = latency
+		self.sent = 0
+
+	async def delay(self):
+		# stands in for the round trip to discord
+		await asyncio.sleep(self.latency)
+
+	async def send(self, *args, **kwargs):
+		await self.delay()
+		self.sent += 1
+		return FakeMessage(self)
+
+class FakeGuild:
+	def __init__(self, emoji, channels, latency):
+		self.id = next(_ids)
+		self.shard_id = 0
+		self.emojis = [FakeEmoji(name) for name in emoji]
+		self.text_channels = [FakeChannel(self, latency) for _ in range(channels)]
+		self.system_channel = self.text_channels[0]
+		self.chunked = True
+		self.members = {}
+
+	def get_channel(self, channel_id):
+		return next((c for c in self.text_channels if c.id == channel_id), None)
+
+	def get_member(self, user_id):
+		return self.members.get(user_id)
+
+	async def fetch_member(self, user_id):
+		return self.members.get(user_id)
+
+async def _nobody_reacts(event, check = None, timeout = None):
+	# so any pagination gives up right away
+	await asyncio.sleep(0)
+	raise asyncio.TimeoutError()
+
+class FakeContext(cmds.Context):
+	"""The library's context, replying in the stand-in channel rather than through discord"""
+	async def send(self, *args, **kwargs):
+		return await self.channel.send(*args, **kwargs)
+
+	async def send_help(self, *args):
+		await self.channel.delay()
+
+class LagMonitor:
+	"""Measures how late the event loop wakes up a task that sleeps on an interval"""
+	def __init__(self, interval = 0.01):
+		self.interval = interval
+		self.lags = []
+		self._task = None
+
+	async def _run(self):
+		loop = asyncio.get_event_loop()
+		while True:
+			start = loop.time()
+			await asyncio.sleep(self.interval)
+			self.lags.append(max(loop.time() - start - self.interval, 0))
+
+	def start(self):
+		self._task = asyncio.ensure_future(self._run())
+
+	def stop(self):
+		self._task.cancel()
+
+def _percentile(values, pct):
+	if not values:
+		return 0.0
+	values = sorted(values)
+	return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+def _parse_mix(text):
+	mix = {}
+	for part in text.split(","):
+		name, _, weight = part.partition("=")
+		if name not in ("roll", "timer", "sw"):
+			raise argparse.ArgumentTypeError(f"unknown command \"{name}\" in mix")
+		mix[name] = float(weight or 1)
+	return mix
+
+def _unlimit():
+	"""Raise the scratch copy's rate limits out of reach, so they're checked but never run dry"""
+	with open("configs/limits.json", "r") as file:
+		limits = json.load(file)
+	for scope in ("user", "channel", "guild"):
+		limits[scope] = {"capacity": 1e12, "rate": 1e12}
+	with open("configs/limits.json", "w") as file:
+		json.dump(limits, file)
+
+async def _run(args):
+	# imported here, after moving into the scratch directory
+	import bot
+	from cogs.modules.limits import RateLimited, Coalesced
+
+	with open("configs/emoji.json", "r") as file:
+		emoji = list(json.load(file).values())
+
+	guilds = [FakeGuild(emoji, args.channels, args.latency) for _ in range(args.guilds)]
+	puck = bot.puck
+	# the library skips messages from the bot's own user, so it needs one
+	puck._connection.user = FakeUser()
+	# nobody here is the owner, so everyone is rate limited
+	puck.owner_id = next(_ids)
+	puck.wait_for = _nobody_reacts
+	users = [FakeUser() for _ in range(args.users)]
+	rng = Random(args.seed)
+	tags = count()
+
+	def roll():
+		return [f"!r {rng.choice(_rolls)}"]
+
+	def timer():
+		return [f"!timer {args.timer_seconds}s load {next(tags)}"]
+
+	def sw():
+		command = rng.choice(("points", "light 1", "dark 1"))
+		if command == "points":
+			return [f"!sw {command}"]
+		# keep the pool from running dry, which would just report an error
+		return ["!sw clear 5 5", f"!sw {command}"]
+
+	commands = {"roll": roll, "timer": timer, "sw": sw}
+	names = list(args.mix)
+	weights = [args.mix[n] for n in names]
+	requests = iter(range(args.requests))
+	latencies = {name: [] for name in names}
+	errors = {name: 0 for name in names}
+	limited = {name: 0 for name in names}
+
+	async def failed(ctx, error):
+		# the bot's own handler runs as well, and replies as it would to anyone
+		name = getattr(ctx, "load_name", None)
+		if name is None:
+			return
+		if isinstance(error, (RateLimited, Coalesced)):
+			limited[name] += 1
+			return
+		errors[name] += 1
+		if args.verbose:
+			print(f"{name} failed:", repr(error))
+	puck.add_listener(failed, "on_command_error")
+
+	async def worker():
+		for _ in requests:
+			name = rng.choices(names, weights)[0]
+			guild = rng.choice(guilds)
+			channel, author = rng.choice(guild.text_channels), rng.choice(users)
+			start = time.perf_counter()
+			for content in commands[name]():
+				ctx = await puck.get_context(FakeMessage(channel, content, author), cls = FakeContext)
+				ctx.load_name = name
+				await puck.invoke(ctx)
+			latencies[name].append(time.perf_counter() - start)
+
+	monitor = LagMonitor()
+	monitor.start()
+	start = time.perf_counter()
+	await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+	elapsed = time.perf_counter() - start
+	monitor.stop()
+	# let any error events still pending be counted
+	await asyncio.sleep(0)
+	# write out anything the cog still has buffered, as a shutdown would
+	puck.get_cog("RPG").cog_unload()
+
+	print(f"{args.requests} commands in {elapsed:.2f}s at concurrency {args.concurrency}: {args.requests / elapsed:.1f}/s")
+	print(f"{'command':<8}{'count':>8}{'errors':>8}{'limited':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+	for name in names:
+		lat = latencies[name]
+		print(f"{name:<8}{len(lat):>8}{errors[name]:>8}{limited[name]:>8}"
+			f"{_percentile(lat, 50) * 1000:>10.2f}{_percentile(lat, 99) * 1000:>10.2f}"
+			f"{max(lat, default=0) * 1000:>10.2f}")
+	print(f"event loop lag: p99 {_percentile(monitor.lags, 99) * 1000:.2f}ms, max {max(monitor.lags, default=0) * 1000:.2f}ms")
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("-n", "--requests", type=int, default=2000, help="total commands to run")
+	parser.add_argument("-c", "--concurrency", type=int, default=50, help="commands in flight at once")
+	parser.add_argument("--mix", type=_parse_mix, default="roll=8,sw=1,timer=1", help="relative weights, e.g. roll=8,sw=1,timer=1")
+	parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per discord API call")
+	parser.add_argument("--timer-seconds", type=int, default=0, help="length of each timer")
+	parser.add_argument("--guilds", type=int, default=10)
+	parser.add_argument("--channels", type=int, default=5, help="channels per guild")
+	parser.add_argument("--users", type=int, default=100)
+	parser.add_argument("--seed", type=int, default=None)
+	parser.add_argument("--limits", action="store_true", help="keep the bot's real rate limits, which most of the load will run into")
+	parser.add_argument("-v", "--verbose", action="store_true", help="print every failed command")
+	args = parser.parse_args()
+
+	# run against copies of the configs, so the bot's real data files are untouched
+	with tempfile.TemporaryDirectory() as scratch:
+		shutil.copytree(_root / "configs", Path(scratch) / "configs")
+		(Path(scratch) / "data").mkdir()
+		os.chdir(scratch)
+		if not args.limits:
+			_unlimit()
+		asyncio.get_event_loop().run_until_complete(_run(args))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,78 @@
+"""
+Checks that a roll timing out in the Offloader only stops its own worker.
+Starts one roll that can't finish in time alongside others that can, some
+of them still running when the slow one is stopped, and fails unless every
+one of those comes back. Run "python offloadtest.py --help".
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+_root = Path(__file__).resolve().parent
+
+async def _run(args):
+	from puckdice import Offloader, TooExpensiveError, Token, Roll, Batch
+
+	# nothing inline, and a worker for every roll, so they all overlap
+	offload = Offloader(inline_limit = 0, timeout = args.timeout, workers = args.rolls + 1)
+	slow = Batch(Token.parse(args.slow))
+	# it has to be rolled, only to run over time
+	offload.check(slow)
+	start = time.perf_counter()
+	log = []
+
+	async def roll(delay):
+		# spread out, so some are mid-roll when the slow one is stopped
+		await asyncio.sleep(delay)
+		began = time.perf_counter() - start
+		try:
+			await offload.evaluate(Roll(Token.parse(args.fast)))
+		except TooExpensiveError as e:
+			log.append((began, time.perf_counter() - start, str(e)))
+			return False
+		log.append((began, time.perf_counter() - start, None))
+		return True
+
+	async def timeout():
+		try:
+			await offload.evaluate(slow)
+		except TooExpensiveError:
+			return time.perf_counter() - start
+		return None
+
+	# starting from halfway to the time limit, to a little past it
+	delays = [args.timeout * (0.5 + 0.75 * i / args.rolls) for i in range(args.rolls)]
+	stopped, *results = await asyncio.gather(timeout(), *map(roll, delays))
+	offload.close()
+
+	if stopped is None:
+		print(f"\"{args.slow}\" finished within {args.timeout}s, so nothing was tested. Try a slower roll")
+		return False
+	running = sum(1 for began, ended, _ in log if began < stopped < ended)
+	print(f"the slow roll was stopped at {stopped:.2f}s, with {running} other rolls in flight")
+	if not running:
+		print("so nothing was tested. Try a slower --fast roll")
+		return False
+	failed = [error for _, _, error in log if error is not None]
+	for error in failed:
+		print("a roll failed:", error)
+	print(f"{results.count(True)} of {len(results)} other rolls finished")
+	return not failed
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--timeout", type=float, default=1.0, help="the offloader's time limit, in seconds")
+	parser.add_argument("--rolls", type=int, default=8, help="other rolls to run around the slow one")
+	parser.add_argument("--slow", default="1900000d100", help="a roll that takes longer than the time limit")
+	parser.add_argument("--fast", default="100000d6", help="a roll that takes much less")
+	args = parser.parse_args()
+
+	# the special dice config is read from the bot's directory
+	os.chdir(_root)
+	sys.exit(0 if asyncio.get_event_loop().run_until_complete(_run(args)) else 1)
+
+if __name__ == "__main__":
+	main()
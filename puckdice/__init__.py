@@ -0,0 +1,8 @@
+"""
+The dice engine behind puck's roll command, free of any discord dependencies.
+Run "python -m puckdice" to roll expressions from stdin in bulk.
+"""
+from .model import DiceConfigError, Category, compile_dice
+from .engine import ParseError, SpecialDie, Token, Program, Roll, Batch
+from .offload import Offloader, TooExpensiveError
+from .stats import DieStats
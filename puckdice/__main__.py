@@ -0,0 +1,63 @@
+from pathlib import Path
+import argparse
+import json
+import random
+import sys
+
+from . import config
+from .engine import ParseError, Token, Batch
+from .offload import Offloader, TooExpensiveError
+from .model import compile_dice
+
+def _roll_json(roll):
+	return {
+		"raw": roll.raw,
+		"tag": roll.tag,
+		"hidden": roll.hidden,
+		"results": [dict(zip(("invoke", "result"), b.render())) for b in roll.bases],
+		"total": roll.num_total,
+		"success": roll.success,
+		"totals": roll.totals,
+		"seed": roll.seed
+	}
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(
+		prog = "python -m puckdice",
+		description = "Roll every expression read from stdin, one per line, writing one JSON result per line to stdout."
+	)
+	parser.add_argument("--config", type=Path, help="the special dice config to use (default: ./configs/dice.json)")
+	parser.add_argument("--seed", help="seed the dice, for reproducible results")
+	parser.add_argument("--max-cost", type=int, default=Offloader().max_cost, help="refuse expressions costing more than this, as the bot does (default: %(default)s)")
+	args = parser.parse_args(argv)
+
+	if args.config is not None:
+		config.dice_model = config.Reader(args.config, compile_dice)
+	if args.seed is not None:
+		random.seed(args.seed)
+
+	# load the config up front, so a bad one fails once instead of on every line
+	try:
+		config.dice_model.load()
+	except (OSError, ValueError) as e:
+		parser.exit(1, f"Could not load the dice config: {e}\n")
+
+	# only used for its cost limit, as everything here is rolled inline
+	offloader = Offloader(max_cost = args.max_cost)
+	for line in sys.stdin:
+		expression = line.strip()
+		if not expression: continue
+
+		# a bad expression only fails its own line
+		try:
+			batch = Batch(Token.parse(expression))
+			offloader.check(batch)
+			batch = batch.evaluate()
+			result = {"expression": expression, "rolls": [_roll_json(r) for r in batch.rolls]}
+		except (ParseError, TooExpensiveError) as e:
+			result = {"expression": expression, "error": str(e)}
+
+		sys.stdout.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+	main()
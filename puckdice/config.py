@@ -0,0 +1,49 @@
+from pathlib import Path
+import json
+import os
+
+from .model import compile_dice
+
+class Reader:
+	def __init__(self, path, compiler = None, default = None):
+		self._path = path
+		self._compiler = compiler
+		# if given, used in place of the file while it doesn't exist
+		self._default = default
+		self._mtime = 0
+		self._data = None
+
+	def _refresh(self):
+		try:
+			mtime = os.path.getmtime(self._path)
+		except FileNotFoundError:
+			if self._default is None:
+				raise
+			self._mtime = 0
+			self._data = self._default
+			return
+
+		if mtime > self._mtime:
+			with open(self._path, "r") as file:
+				data = json.load(file)
+			# compile before storing anything, so a bad file is rejected whole
+			if self._compiler is not None:
+				data = self._compiler(data)
+			self._mtime = mtime
+			self._data = data
+
+	def load(self):
+		"""Get the current data, reloading it if the file has changed"""
+		self._refresh()
+		return self._data
+
+	def __getitem__(self, item):
+		self._refresh()
+		return self._data[item]
+		
+	def __getattr__(self, attr):
+		self._refresh()
+		return getattr(self._data, attr)
+
+# the special dice the engine rolls. replace this to use another file
+dice_model = Reader(Path("./configs/dice.json"), compile_dice)
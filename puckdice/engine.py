@@ -0,0 +1,1038 @@
+from collections import Counter, OrderedDict
+from random import Random, getrandbits
+from typing import NamedTuple, Union, List
+import json
+import zlib
+
+from . import config
+from .model import Category
+
+class ParseError(ValueError):
+	"""A roll that can't be made sense of, noting where in its text the problem is"""
+	def __init__(self, message:str, token = None):
+		self.pos = None if token is None else token.pos
+		if self.pos is not None:
+			message = f"{message.rstrip('.')} at character {self.pos + 1}."
+		super().__init__(message)
+
+class SpecialDie:
+	"""Represents a single special die roll, as a vector of symbol counts"""
+	__slots__ = "value", "category"
+	def __init__(self, value:tuple, category:Category):
+		self.value = tuple(value)
+		self.category = category
+
+	@property
+	def reduced(self):
+		values = list(self.value)
+		config = self.category
+
+		# first, reduce any values to their generic version
+		for source, target in config.reduce:
+			values[target] += values[source]
+			values[source] = 0
+
+		# next, cancel any elements that do so
+		for group in config.cancels:
+			if len(group) == 2:
+				first, second = group
+				common = min(values[first], values[second])
+				values[first] -= common
+				values[second] -= common
+				continue
+
+			while True:
+				# get the two values of this group with the
+				# largest number of present items in values
+				first, second = sorted(group, key=values.__getitem__)[-2:]
+
+				# if either is zero, then this group is canceled
+				if not values[first]: break
+
+				# otherwise, reduce both values by one
+				values[first] -= 1
+				values[second] -= 1
+
+		# then remove any elements designated as blanks
+		for blank in config.blanks:
+			values[blank] = 0
+
+		# return the reduced copy
+		return SpecialDie(values, config)
+
+	def __add__(self, other):
+		if not isinstance(other, type(self)) \
+		or not self.category.name == other.category.name:
+			return NotImplemented
+
+		value = map(int.__add__, self.value, other.value)
+		return type(self)(value, self.category)
+
+	def render(self, symbols = None):
+		"""
+		Render the symbols rolled. If given, "symbols" is called with the
+		category to get the string to display for each symbol id.
+		"""
+		config = self.category
+		table = config.symbols if symbols is None else symbols(config)
+		limit = config.max_consecutive
+		parts = []
+		for i in config.order:
+			count = self.value[i]
+			if not count: continue
+			if limit is not None and count > limit:
+				parts.append(table[i] + f"x{count}")
+			else:
+				parts.extend([table[i]] * count)
+		return " ".join(parts) or table[config.default]
+
+	__str__ = lambda s: s.render()
+	__deepcopy__ = lambda s, m: type(s)(s.value, s.category)
+	__repr__ = lambda s: f"SpecialDie({s.value!r}, {s.category.name!r})"
+
+# the instructions a compiled Program is made of. each one is a tuple of
+# one of these, the index of the base it acts on, and then its arguments
+ROLL, FLAT, EXPLODE, EXPLODE_ALL, KEEP, FILTER, COUNT, PASS, SUBTOTAL, SPECIAL = range(10)
+
+class Dice:
+	"""The numeric dice rolled for one base, kept as parallel lists"""
+	__slots__ = "values", "depths", "valid", "override", "minv", "maxv"
+	def __init__(self, values:list, minv:int, maxv:int):
+		self.values = values
+		# -1 for flat modifiers, 0 for the first dice, and 1+ for explosions
+		self.depths = [0] * len(values)
+		self.valid = [True] * len(values)
+		self.override = None
+		self.minv = minv
+		self.maxv = maxv
+
+	def add(self, value:int, depth:int):
+		self.values.append(value)
+		self.depths.append(depth)
+		self.valid.append(True)
+
+	@property
+	def result(self):
+		data = dict()
+		for value, dp, valid in zip(self.values, self.depths, self.valid):
+			if dp not in data:
+				data[dp] = {True:[], False:[]}
+			if dp == -1:
+				data[dp][valid].append(f"{value:+}")
+			else:
+				data[dp][valid].append(str(value))
+
+		lists = []
+		flats = []
+		for depth, dice in sorted(data.items()):
+			if depth == -1:
+				parens = ("(", ")")
+			elif depth == 0:
+				parens = ("", "")
+			else:
+				parens = ("[", "]")
+
+			s = parens[0]
+			if data[depth][False]:
+				s += f"~~{', '.join(data[depth][False])}~~"
+				if data[depth][True]:
+					s += ", "
+			if depth == -1:
+				flats.append(s + ", ".join(data[depth][True]) + parens[1])
+			else:
+				lists.append(s + ", ".join(data[depth][True]) + parens[1])
+
+		s = " ".join(lists + flats)
+		if isinstance(self.override, bool):
+			s += f" -> {'Success' if self.override else 'Failure'}"
+		elif self.override is not None:
+			s += f" -> {self.override}"
+
+		return s
+
+	@property
+	def total(self):
+		return sum(v for v, valid in zip(self.values, self.valid) if valid)
+
+class BlankBase:
+	"""How to show a base that rolls nothing"""
+	__slots__ = ()
+	render = lambda s, state, symbols = None: ("", "")
+	total = lambda s, state: None
+
+class NumberBase(NamedTuple):
+	"""How to show a flat number on its own"""
+	value: int
+
+	def render(self, state, symbols = None):
+		return f"[{self.value:+}]", f"{self.value:+}"
+
+	def total(self, state):
+		return self.value
+
+class DiceBase(NamedTuple):
+	"""How to show a numeric roll, given its Dice"""
+	invoke: str
+	# the sum of the flat modifiers on this roll
+	flat: int
+
+	def render(self, state, symbols = None):
+		return self.invoke, ("" if state is None else state.result)
+
+	def total(self, state):
+		if state.override is None:
+			return state.total
+
+		if isinstance(state.override, bool):
+			return state.override
+
+		return state.override + self.flat
+
+	def faces(self, state):
+		"""Get the die's name, its lowest face, its number of sides, and how often each face came up"""
+		# negative rolls are made with negated dice
+		if state.minv < 0:
+			low, high, sign = -state.maxv, -state.minv, -1
+		else:
+			low, high, sign = state.minv, state.maxv, 1
+		name = f"d{high}" if low == 1 else f"r{low}-{high}"
+		counts = Counter(sign * v - low for v, d in zip(state.values, state.depths) if d >= 0)
+		return name, low, high - low + 1, counts
+
+class SpecialBase(NamedTuple):
+	"""How to show a roll of special dice, given the index of each face rolled"""
+	category: Category
+	name: str
+	pool: int
+	faces: tuple
+
+	def render(self, state, symbols = None):
+		"""Get the invoke and result strings. "symbols" is as in SpecialDie.render"""
+		table = self.category.symbols if symbols is None else symbols(self.category)
+		name = self.name and table[self.category.symbol_ids[self.name]]
+		invoke = f"{self.pool}{self.category.delimiter}{name}"
+		result = ", ".join(SpecialDie(self.faces[i], self.category).render(symbols) for i in state or ())
+		return invoke, result
+
+	def total(self, state):
+		if not state:
+			return SpecialDie(self.category.zero, self.category)
+		return SpecialDie(map(sum, zip(*map(self.faces.__getitem__, state))), self.category)
+
+class Entry:
+	"""A node of the tree a roll is parsed into, before being compiled"""
+	__slots__ = "_parent", "_children", "token"
+	_allowed_additions = ()
+	def __init__(self, token = None):
+		self.token = token
+		self._parent = None
+		self._children = []
+
+	def add(self, item):
+		if not isinstance(item, Entry):
+			raise ValueError("Added item must be a subclass of Entry")
+
+		if type(item) in self._allowed_additions:
+			self._children.append(item)
+			item._parent = self
+			return True
+
+		if self._parent is None:
+			return False
+
+		return self._parent.add(item)
+
+	def as_tag(self):
+		s = ""
+		if self.token is not None:
+			s += self.token.raw
+
+		for child in self._children:
+			s += child.as_tag()
+
+		return s
+
+	@property
+	def cost(self):
+		"""Roughly how much work evaluating this will take, in dice handled"""
+		return 1
+
+	# shown in errors, so it's written as the user typed it
+	__repr__ = lambda s: type(s).__name__ if s.token is None else s.token.raw.strip()
+
+	def compile(self, index:int, code:list):
+		"""Append the instructions for this base to code, and return how to show it"""
+		return BlankBase()
+
+class RootEntry:
+	"""A base class to track which classes can be roots of their Entry trees."""
+	__slots__ = ()
+
+class OneChild(Entry):
+	"""Any Entry which can accept only one child"""
+	__slots__ = ()
+	def add(self, item):
+		if len(self._children) > 0:
+			if self._parent is None:
+				return False
+			return self._parent.add(item)
+
+		return super().add(item)
+
+class NoChild(Entry):
+	"""Any Entry which can accept no children"""
+	__slots__ = ()
+	def add(self, item):
+		if self._parent is None:
+			return False
+		return self._parent.add(item)
+
+class Number(Entry, RootEntry):
+	"""Represents a number, wither as an argument for a modifier, or a flat addition to a roll."""
+	__slots__ = "value",
+	def __init__(self, value, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.value = int(value)
+
+	@property
+	def invoke(self):
+		return f"[{self.value:+}]"
+
+	def compile(self, index:int, code:list):
+		return NumberBase(self.value)
+
+class Flat(Number):
+	"""Represents a flat modifier to a numeric roll (but not an argument to another modifier)."""
+	__slots__ = ()
+
+class Modifier(OneChild):
+	"""Represents a modifier to a numeric roll."""
+	__slots__ = "name", "_default", "_hidden", "_comp"
+	_allowed_additions = (Number,)
+	# this stores the defalt value, and whether to hide that 
+	# value if it's the one used, and any comparison function
+	_configs = {
+		"xx": (1, True, None), 
+		"x": (1, True, None), 
+		"<=": (0, False, int.__le__), 
+		">=": (0, False, int.__ge__), 
+		"<": (0, False, int.__lt__), 
+		">": (0, False, int.__gt__), 
+		"=": (0, False, int.__eq__), 
+		"min": (1, True, None), 
+		"max": (1, True, None)
+	}
+	def __init__(self, name, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		# keywords are matched in any case, but the token keeps them as written
+		self.name = name.lower()
+		configs = self._configs.get(self.name)
+		if configs is None:
+			raise ParseError(f"\"{name}\" isn't a modifier I know.", self.token)
+		self._default = configs[0]
+		self._hidden = configs[1]
+		self._comp = configs[2]
+
+	@property
+	def argument(self):
+		"""The value supplied to this modifier, or its default"""
+		if self._children:
+			return self._children[0].value
+		return self._default
+
+	@property
+	def invoke(self):
+		value = self.argument
+		if self._hidden and value == self._default:
+			return f" [{self.name}]"
+		return f" [{self.name} {value}]"
+
+	def compile(self, index:int, code:list, flat:int = 0):
+		if self.name == "x":
+			code.append((EXPLODE, index, self.argument))
+		elif self.name == "xx":
+			code.append((EXPLODE_ALL, index, self.argument))
+		elif self.name in ("min", "max"):
+			code.append((KEEP, index, self.argument, self.name == "max"))
+		else:
+			code.append((FILTER, index, self._comp, self.argument, flat))
+
+class Flag(Modifier, NoChild):
+	"""Represents a modifier to a numeric roll without an argument"""
+	__slots__ = ()
+	# this stores the defalt value, and whether to hide that 
+	# value if it's the one used, and any comparison function
+	_configs = {
+		"num": (0, True, None),
+		"count": (0, True, None),
+		"pas": (0, True, None),
+		"success": (0, True, None),
+		"quiet": (0, True, None),
+		"subtotal": (0, True, None),
+		"sub": (0, True, None)
+	}
+	# the instruction for each flag, if it has one
+	_ops = {
+		"num": COUNT,
+		"count": COUNT,
+		"pas": PASS,
+		"success": PASS,
+		"subtotal": SUBTOTAL,
+		"sub": SUBTOTAL
+	}
+
+	def compile(self, index:int, code:list, flat:int = 0):
+		if self.name in self._ops:
+			code.append((self._ops[self.name], index))
+
+class Ranged(Entry, RootEntry):
+	"""Represents a dice roll in the form "XrY-Z", which rolls X dice numbered Y-Z."""
+	__slots__ = "sign", "pool", "minv", "maxv", "_invoke"
+	_allowed_additions = Number, Flat, Modifier, Flag
+	def __init__(self, sign, pool, minv, maxv, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.sign = "-" if sign == "-" else "+"
+		self.pool = int(pool or 1)
+		self.minv = int(minv)
+		self.maxv = int(maxv)
+		self._invoke = f"{self.sign}{self.pool}r{self.minv}-{self.maxv}"
+
+	@property
+	def cost(self):
+		sides = max(self.maxv - self.minv + 1, 1)
+		dice = self.pool
+		for mod in self._children:
+			if not isinstance(mod, Modifier) or mod.name not in ("x", "xx"):
+				continue
+			# the chance of any one die exploding
+			chance = min(max(mod.argument, 0), sides) / sides
+			if mod.name == "x":
+				dice += self.pool * chance
+			else:
+				# each level explodes again, up to the 64 level cap
+				dice += self.pool * sum(chance ** level for level in range(1, 64))
+
+		# every modifier makes another pass over the dice
+		return int(dice * (1 + len(self._children)))
+
+	def compile(self, index:int, code:list):
+		if self.sign == "+":
+			code.append((ROLL, index, self.pool, self.minv, self.maxv))
+		else:
+			code.append((ROLL, index, self.pool, -self.maxv, -self.minv))
+
+		sort = dict(flat = [], x = [], comp = [], flag = [])
+		for child in self._children:
+			if isinstance(child, Flat):
+				sort["flat"].append(child)
+			elif isinstance(child, Flag):
+				sort["flag"].append(child)
+			elif not isinstance(child, Modifier):
+				raise ParseError(f"Cannot fit \"{child!r}\" in tree.", child.token)
+			elif child.name in ("x", "xx"):
+				sort["x"].append(child)
+			else:
+				sort["comp"].append(child)
+
+		# flat modifiers come first, since comparisons include them
+		flat = 0
+		for child in sort["flat"]:
+			code.append((FLAT, index, child.value))
+			flat += child.value
+
+		for child in sort["x"] + sort["comp"] + sort["flag"]:
+			child.compile(index, code, flat=flat)
+
+		invoke = self._invoke
+		if any(c.name == "quiet" for c in sort["flag"]):
+			invoke = f"{self._invoke} [...]"
+		else:
+			for mod in self._children:
+				invoke += mod.invoke
+		return DiceBase(invoke, flat)
+
+class Basic(Ranged, RootEntry):
+	"""Represents a dice roll in the form "XdY", which rolls X Y-sided dice."""
+	__slots__ = ()
+	def __init__(self, sign, pool, maxv, *args, **kwargs):
+		super().__init__(sign, pool, 1, maxv, *args, **kwargs)
+		self._invoke = f"{self.sign}{self.pool}d{self.maxv}"
+
+class Special(Entry, RootEntry):
+	"""Represents any roll of dice defined in the dice.json config file"""
+	__slots__ = "pool", "name", "category", "alias"
+	def __init__(self, pool, name, category, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		if isinstance(category, str):
+			category = config.dice_model[category]
+		self.category = category
+		self.pool = int(pool or 1)
+		self.alias = name
+		# an empty name makes a dummy with blank dice, for addition
+		self.name = name and category.aliases[name.lower()]
+
+	@property
+	def cost(self):
+		# each die is a vector of symbol counts to add up
+		return self.pool * (1 + len(self.category.symbols))
+
+	def compile(self, index:int, code:list):
+		if self.name:
+			faces = self.category.faces[self.name]
+		else:
+			faces = (self.category.zero,)
+		code.append((SPECIAL, index, self.pool, range(len(faces))))
+		return SpecialBase(self.category, self.name, self.pool, faces)
+
+class NewBase(Entry, RootEntry):
+	"""Represents a request to force the beginning of a new base next"""
+	__slots__ = ()
+
+class Tag(Entry):
+	"""Represents miscellaneous other text used to tag a roll."""
+	__slots__ = "value"
+	_allowed_additions = Modifier, Number, Flat, Flag, NewBase
+	def __init__(self, value, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.value = value
+
+class MasterTag(Entry, RootEntry):
+	"""Each roll will have one MasterTag that has all other tags as children."""
+	__slots__ = ()
+	_allowed_additions = (Tag,)
+
+	@property
+	def is_empty(self):
+		return not self._children
+
+class Hidden(Entry, RootEntry):
+	"""Represents a request to hide the rolls and just show the results"""
+	__slots__ = ()
+
+def _digits(text:str, pos:int):
+	"""Get the index just past the run of digits starting at pos"""
+	while text[pos:pos + 1].isdecimal():
+		pos += 1
+	return pos
+
+class Token:
+	__slots__ = "name", "args", "raw", "subname", "pos"
+	# the keywords that can start a token, by their first letter, as
+	# (token name, keyword) pairs in the order they're tried
+	_keywords = {}
+	for name, words in (
+		("flag", tuple(Flag._configs)),
+		("hidden", ("hidden",)),
+		("modifier", ("xx", "x", "<=", ">=", "<", ">", "=", "min", "max"))
+	):
+		for word in words:
+			_keywords.setdefault(word[0], []).append((name, word))
+	del name, words, word
+
+	# the dice model the special dice lookup was built from, that lookup, of
+	# lowercase "delimiter + alias" -> (category name, delimiter length), and
+	# the plan key for it
+	_specials = (None, None, None)
+	# bump whenever the tokenizer's output changes, so stored plans are parsed again
+	plan_version = 1
+
+	@classmethod
+	def _get_specials(cls):
+		"""Get the special dice lookup, rebuilding it if the dice config changed"""
+		model = config.dice_model.load()
+		if cls._specials[0] is not model:
+			specials = {}
+			for name, category in model.items():
+				for aliases in category.die_aliases.values():
+					for alias in aliases:
+						# earlier categories win if two spell a die the same way
+						key = (category.delimiter + alias).lower()
+						specials.setdefault(key, (name, len(category.delimiter)))
+			# a plan made with other special dice could have tokenized differently
+			checksum = zlib.crc32(repr(sorted(specials.items())).encode())
+			cls._specials = (model, specials, f"{cls.plan_version}:{checksum:08x}")
+		return cls._specials[1]
+
+	@classmethod
+	def plan_key(cls):
+		"""Get the key a plan from dump() must have been made under to still be used"""
+		cls._get_specials()
+		return cls._specials[2]
+
+	@staticmethod
+	def dump(tokens) -> bytes:
+		"""
+		Write tokens parsed from some text compactly, as a plan that load()
+		can turn back into tokens, given the same text, without parsing it.
+		"""
+		# each token's raw text runs up to the next token, so only where it starts is kept
+		fields = [(t.name, t.args, t.subname, t.pos) for t in tokens]
+		return json.dumps(fields, separators = (",", ":")).encode()
+
+	@classmethod
+	def load(cls, text: str, plan: bytes):
+		"""Read back the tokens dump() wrote for this text"""
+		fields = json.loads(plan)
+		ends = [f[3] for f in fields[1:]] + [len(text)]
+		return [
+			cls(name, text[pos:end], tuple(args), subname, pos)
+			for (name, args, subname, pos), end in zip(fields, ends)
+		]
+
+	@classmethod
+	def _scan(cls, word:str, start:int, first:bool):
+		"""
+		Find the token at "start" in a word (with no whitespace), as its name,
+		args, and end. "first" is whether the word starts the parsed string.
+		"""
+		char = word[start]
+
+		# numeric dice, like "+2d6" and "r1-4"
+		sign = start + (char in "+-")
+		digits = _digits(word, sign)
+		letter = word[digits:digits + 1]
+		if letter in ("d", "D"):
+			maxv = _digits(word, digits + 1)
+			if maxv > digits + 1:
+				return "basic", (word[start:sign], word[sign:digits], word[digits + 1:maxv]), maxv
+		elif letter in ("r", "R"):
+			minv = _digits(word, digits + 1)
+			if minv > digits + 1 and word[minv:minv + 1] == "-":
+				maxv = _digits(word, minv + 1)
+				if maxv > minv + 1:
+					args = (word[start:sign], word[sign:digits], word[digits + 1:minv], word[minv + 1:maxv])
+					return "range", args, maxv
+
+		if digits > sign:
+			if sign > start:
+				return "flat", (word[start:digits],), digits
+			# "Nx" at the very start of a roll repeats the whole roll N times
+			if first and start == 0 and letter in ("x", "X", "×"):
+				return "repeat", (word[:digits],), digits + 1
+			return "number", (word[start:digits],), digits
+
+		for name, keyword in cls._keywords.get(char.lower(), ()):
+			stop = start + len(keyword)
+			if word[start:stop].lower() == keyword:
+				return name, (() if name == "hidden" else (word[start:stop],)), stop
+
+		if char == ",":
+			return "newbase", (), start + 1
+
+		# anything else is a tag, up to the end of the word
+		return "tag", None, len(word)
+
+	@classmethod
+	def parse(cls, arg):
+		"""Parse a string into tokens, in a single pass over it"""
+		specials = cls._get_specials()
+		tokens = []
+		# tokens never span whitespace, so work one word at a time
+		words = arg.split()
+		pos = 0
+		starts = []
+		for word in words:
+			# only whitespace comes before each word, so this always finds it
+			pos = arg.index(word, pos)
+			starts.append(pos)
+			pos += len(word)
+		starts.append(len(arg))
+
+		for i, word in enumerate(words):
+			pos = starts[i]
+			size = len(word)
+			# every token takes the whitespace after it along with it
+			space = arg[pos + size:starts[i + 1]]
+
+			# special dice, like "2swy", are always whole words
+			digits = _digits(word, 0)
+			special = specials.get(word[digits:].lower())
+			if special is not None:
+				name, delimiter = special
+				args = (word[:digits], word[digits + delimiter:])
+				tokens.append(cls("special", word + space, args, name, pos))
+				continue
+
+			start = 0
+			while start < size:
+				name, args, stop = cls._scan(word, start, pos == 0)
+				raw = word[start:stop] + space if stop == size else word[start:stop]
+				tokens.append(cls(name, raw, (raw,) if args is None else args, None, pos + start))
+				start = stop
+
+		return tokens
+
+	def __init__(self, name, raw, args, subname=None, pos=None):
+		self.name = name
+		self.raw = raw
+		self.args = args
+		self.subname = subname
+		# where in the parsed string this token started, if known
+		self.pos = pos
+
+	def __setstate__(self, state):
+		# tokens pickled before they had positions don't have one
+		self.pos = None
+		for key, value in state[1].items():
+			setattr(self, key, value)
+
+	__str__ = lambda s: f"{s.name}: {s.args}"
+	__repr__ = lambda s: f"Token({s.name!r}, {s.args!r})"
+
+class Program:
+	"""
+	A roll compiled to a flat list of instructions, which can be run any
+	number of times. Compiled programs are cached by the roll's tokens.
+	"""
+	__slots__ = "tokens", "raw", "tag", "hidden", "bases", "code", "cost", "model"
+	# a dict of classes that represent the entry types
+	# the keys are the same as the Token._regexes, plus "special" and "tag"
+	_classes = {
+		"basic": Basic,
+		"range": Ranged,
+		"flat": Flat,
+		"number": Number,
+		"flag": Flag,
+		"modifier": Modifier,
+		"hidden": Hidden,
+		"special": Special,
+		"tag": Tag,
+		"newbase": NewBase
+	}
+	# the most recently used programs, by their tokens
+	_cache = OrderedDict()
+	_cache_size = 256
+
+	@classmethod
+	def get(cls, tokens):
+		"""Get the program for some tokens, compiling it if it isn't cached"""
+		key = tuple((t.name, t.raw, t.args, t.subname) for t in tokens)
+		program = cls._cache.get(key)
+		# programs with special dice are compiled again if the dice config changed
+		if program is not None and program.model in (None, config.dice_model.load()):
+			cls._cache.move_to_end(key)
+			return program
+
+		program = cls(tokens)
+		cls._cache[key] = program
+		if len(cls._cache) > cls._cache_size:
+			cls._cache.popitem(last=False)
+		return program
+
+	def __init__(self, tokens):
+		self.tokens = tokens
+		tag = MasterTag()
+		self.raw = " ".join(map(lambda t:t.raw.strip(), tokens))
+		self.hidden = False
+		self.model = None
+
+		# here we turn each token into a full "Entry" subclass instance
+		# then add each into a series of tree structures for compiling
+		# "prev" will track the last "Entry" subclass instance created
+		# "nextnew" will track requests to begin a new base next instead
+		nextnew = False
+		prev = None
+		bases = []
+		for token in tokens:
+			# repeats are handled by Batch, before the roll is made
+			if token.name == "repeat":
+				raise ParseError(f"\"{token.raw.strip()}\" can only be used at the start of a roll.", token)
+
+			# first get the appropriate class, and make the instance
+			cls = self._classes[token.name]
+			args = token.args
+			if token.name == "special":
+				new = cls(*args, token=token, category=token.subname)
+				self.model = config.dice_model.load()
+			else:
+				new = cls(*args, token=token)
+
+			# any tags (and whitespace) get added to the master tag. this should never fail
+			if isinstance(new, Tag):
+				tag.add(new)
+
+			# if this is flagged as hidden, save that and discard the Entry
+			elif isinstance(new, Hidden):
+				self.hidden = True
+				continue
+
+			# if this isn't the first token, try to add it to the prev tree
+			elif prev is not None:
+				# if the next one is requested to be a base, don't try adding it first
+				if nextnew:
+					success = False
+				else:
+					success = prev.add(new)
+
+				# if it fails and is a possible root, add it to bases
+				# otherwise, raise an error
+				if success is False:
+					# if it fails as a NewBase, then it wasn't just a comma
+					# and is actualy signaling a new base request
+					if isinstance(new, NewBase):
+						nextnew = True
+
+					# if it fails and is not a possible base, raise an error
+					elif not isinstance(new, RootEntry):
+						raise ParseError(f"Cannot fit \"{new!r}\" in tree.", token)
+
+					# otherwise, add it as a base
+					else:
+						bases.append(new)
+						nextnew = False
+
+			# if it's the first token
+			else:
+				# and it's a valid root, add it to bases
+				if isinstance(new, RootEntry):
+					bases.append(new)
+
+				# otherwise, try to add it to a tag, raising an error if that fails
+				else:
+					newtag = Tag("")
+					success = newtag.add(new)
+					if success is False:
+						raise ParseError(f"\"{new!r}\" cannot be a base or tag.", token)
+					tag.add(newtag)
+
+			# set the next "prev" value to this token's class, if applicable
+			prev = new
+
+		# the tree is only needed until it's been compiled
+		self.tag = None if tag.is_empty else tag.as_tag()
+		self.cost = len(tokens) + sum(base.cost for base in bases)
+		self.code = []
+		self.bases = tuple(base.compile(i, self.code) for i, base in enumerate(bases))
+
+	# sent to worker processes as its tokens, to be compiled or found in their own cache
+	__reduce__ = lambda s: (Program.get, (s.tokens,))
+
+	def run(self, rng:Random):
+		"""Roll the dice with the given generator, returning the state of each base"""
+		randint = rng.randint
+		choice = rng.choice
+		states = [None] * len(self.bases)
+		for ins in self.code:
+			op = ins[0]
+			dice = states[ins[1]]
+
+			if op == ROLL:
+				size, minv, maxv = ins[2:]
+				states[ins[1]] = Dice([randint(minv, maxv) for _ in range(size)], minv, maxv)
+
+			elif op == FLAT:
+				dice.add(ins[2], -1)
+
+			elif op == EXPLODE:
+				thold = abs(dice.maxv) - ins[2]
+				toadd = sum(abs(v) > thold for v, d in zip(dice.values, dice.depths) if d >= 0)
+				for _ in range(toadd):
+					dice.add(randint(dice.minv, dice.maxv), 1)
+
+			elif op == EXPLODE_ALL:
+				thold = max(abs(dice.maxv), abs(dice.minv)) - ins[2]
+				toadd = sum(abs(v) > thold for v, d in zip(dice.values, dice.depths) if d >= 0)
+				level = 1
+				while (toadd > 0) and (level < 64):
+					for _ in range(toadd):
+						value = randint(dice.minv, dice.maxv)
+						dice.add(value, level)
+						# only decrement toadd if the value misses the threshold
+						toadd -= abs(value) <= thold
+					level += 1
+
+			elif op == KEEP:
+				values, depths, valid = dice.values, dice.depths, dice.valid
+				ordered = sorted(range(len(values)), key=values.__getitem__, reverse=ins[3])
+				for i in ordered[ins[2]:]:
+					if depths[i] >= 0:
+						valid[i] = False
+
+			elif op == FILTER:
+				comp, value, flat = ins[2:]
+				for i, v in enumerate(dice.values):
+					if dice.depths[i] >= 0 and not comp(v + flat, value):
+						dice.valid[i] = False
+
+			elif op == COUNT:
+				dice.override = sum(dice.valid)
+
+			elif op == PASS:
+				dice.override = any(dice.valid)
+
+			elif op == SUBTOTAL:
+				dice.override = dice.total
+
+			elif op == SPECIAL:
+				# the index of each face rolled
+				faces = ins[3]
+				states[ins[1]] = tuple(choice(faces) for _ in range(ins[2]))
+
+		return states
+
+class Result:
+	"""One base of a roll, along with whatever it rolled"""
+	__slots__ = "base", "state"
+	def __init__(self, base, state):
+		self.base = base
+		self.state = state
+
+	def render(self, symbols = None):
+		"""Get the invoke and result strings. "symbols" is as in SpecialDie.render"""
+		return self.base.render(self.state, symbols)
+
+	@property
+	def total(self):
+		return self.base.total(self.state)
+
+class Roll:
+	def __init__(self, tokens, program:Program = None):
+		self.tokens = tokens
+		self.program = program or Program.get(tokens)
+		self.raw = self.program.raw
+		self.tag = self.program.tag
+		self.hidden = self.program.hidden
+		self.states = [None] * len(self.program.bases)
+		# the seed the dice are rolled from, so the roll can be replayed exactly
+		self.seed = None
+
+	def evaluate(self):
+		if self.seed is None:
+			self.seed = getrandbits(64)
+		self.states = self.program.run(Random(self.seed))
+		return self
+
+	@property
+	def cost(self):
+		"""Roughly how much work evaluating this will take, in dice handled"""
+		return self.program.cost
+
+	@property
+	def bases(self):
+		return [Result(b, s) for b, s in zip(self.program.bases, self.states)]
+
+	def faces(self):
+		"""
+		Yield every kind of die rolled, as its name, the number on its first face
+		(or None for special dice), its number of sides, and a Counter of how
+		often each face (numbered from 0) came up.
+		"""
+		for base, state in zip(self.program.bases, self.states):
+			if isinstance(base, DiceBase) and state is not None:
+				yield base.faces(state)
+			elif isinstance(base, SpecialBase) and base.name and state:
+				name = f"{base.category.delimiter}{base.name}"
+				yield name, None, len(base.faces), Counter(state)
+
+	@property
+	def num_total(self):
+		result = None
+		for base, state in zip(self.program.bases, self.states):
+			if isinstance(base, (NumberBase, DiceBase)):
+				total = base.total(state)
+				if not isinstance(total, bool):
+					result = (result or 0) + total
+
+		return result
+
+	@property
+	def other_totals(self):
+		return self.render_other_totals()
+
+	@property
+	def success(self):
+		"""Whether every pass/fail roll passed, or None if there were none"""
+		success = None
+		for base, state in zip(self.program.bases, self.states):
+			if isinstance(base, DiceBase) and isinstance(state.override, bool):
+				if success is None: success = True
+				success &= state.override
+		return success
+
+	def render_other_totals(self, symbols = None):
+		"""Get the non-numeric totals. "symbols" is as in SpecialDie.render"""
+		success = self.success
+		specials = {}
+		for base, state in zip(self.program.bases, self.states):
+			# add any special dice results
+			if isinstance(base, SpecialBase):
+				name = base.category.name
+				if name in specials:
+					specials[name] += base.total(state)
+				else:
+					specials[name] = base.total(state)
+
+		results = []
+		if success is not None:
+			results.append("Success" if success else "Failure")
+
+		for sdie in specials.values():
+			results.append(sdie.reduced.render(symbols))
+
+		return results
+
+	@property
+	def totals(self):
+		return self.render_totals()
+
+	def render_totals(self, symbols = None):
+		"""Get all the totals. "symbols" is as in SpecialDie.render"""
+		num = self.num_total
+		if num is not None:
+			return [str(num)] + self.render_other_totals(symbols)
+		return self.render_other_totals(symbols)
+
+class Batch:
+	"""Represents one roll, parsed once and then evaluated several times"""
+	# the most rolls a single batch may contain
+	max_count = 100
+
+	def __init__(self, tokens, count:int = 1):
+		# a leading "Nx" multiplies the requested count
+		if tokens and tokens[0].name == "repeat":
+			count *= int(tokens[0].args[0])
+			tokens = tokens[1:]
+
+		self.tokens = tokens
+		self.count = count
+		self.raw = " ".join(map(lambda t:t.raw.strip(), tokens))
+		self.rolls = []
+		# each roll's seed is drawn from this one, so the batch can be replayed exactly
+		self.seed = None
+
+	def evaluate(self):
+		if not 0 < self.count <= self.max_count:
+			raise ValueError(f"A batch must have between 1 and {self.max_count} rolls.")
+		if self.seed is None:
+			self.seed = getrandbits(64)
+		rng = Random(self.seed)
+		# every roll runs the same compiled program
+		program = Program.get(self.tokens)
+		self.rolls = []
+		for _ in range(self.count):
+			roll = Roll(self.tokens, program)
+			roll.seed = rng.getrandbits(64)
+			self.rolls.append(roll.evaluate())
+		return self
+
+	@property
+	def cost(self):
+		"""Roughly how much work evaluating this will take, in dice handled"""
+		return self.count * Program.get(self.tokens).cost
+
+	@property
+	def stats(self):
+		"""Get the numeric totals' sum, mean, min, and max, or None if there are none"""
+		nums = [r.num_total for r in self.rolls]
+		nums = [n for n in nums if n is not None]
+		if not nums:
+			return None
+		return sum(nums), sum(nums) / len(nums), min(nums), max(nums)
+
+	@property
+	def successes(self):
+		"""Get how many rolls passed, or None if none of them were pass/fail"""
+		results = [r.success for r in self.rolls]
+		if all(r is None for r in results):
+			return None
+		return sum(bool(r) for r in results)
@@ -0,0 +1,175 @@
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+import re
+
+_emoji_regex = re.compile(r":(\w+?):")
+
+class DiceConfigError(ValueError): pass
+
+class Category(NamedTuple):
+	"""An immutable, compiled category of special dice from the dice.json config"""
+	name: str
+	delimiter: str
+	# every symbol used by this category, die names included.
+	# a symbol's id is its index here
+	symbols: Tuple[str, ...]
+	symbol_ids: Mapping[str, int]
+	# the emoji name of each symbol written as ":name:", otherwise None
+	emoji: Tuple[Optional[str], ...]
+	# the dice in config order, and the aliases listed for each
+	dice: Tuple[str, ...]
+	die_aliases: Mapping[str, Tuple[str, ...]]
+	# lowercase alias -> die name
+	aliases: Mapping[str, str]
+	# die name -> faces, each face a vector of symbol counts indexed by id
+	faces: Mapping[str, Tuple[Tuple[int, ...], ...]]
+	# (from, to) symbol id pairs, applied in order when reducing
+	reduce: Tuple[Tuple[int, int], ...]
+	cancels: Tuple[Tuple[int, ...], ...]
+	blanks: Tuple[int, ...]
+	default: int
+	max_consecutive: Optional[int]
+	# symbol ids sorted by symbol name, the order results are shown in
+	order: Tuple[int, ...]
+	# regex source matching one roll of this category in a roll command
+	pattern: str
+
+	@property
+	def zero(self):
+		return (0,) * len(self.symbols)
+
+	def __reduce__(self):
+		# pickled by name, so rolls can be sent between processes
+		return _lookup, (self.name,)
+
+def _lookup(name):
+	from .config import dice_model
+	return dice_model[name]
+
+def compile_dice(data):
+	"""Compile the raw dice.json data, raising DiceConfigError if it's malformed"""
+	if not isinstance(data, dict):
+		raise DiceConfigError("The dice config must be an object of categories")
+
+	return MappingProxyType({
+		name: _compile_category(name, config) for name, config in data.items()
+	})
+
+def _compile_category(name, config):
+	def fail(msg):
+		raise DiceConfigError(f"Dice category \"{name}\": {msg}")
+
+	# category names become regex group names when parsing rolls
+	if not name.isidentifier():
+		fail("the category name must be a valid identifier")
+	if not isinstance(config, dict):
+		fail("must be an object")
+	missing = {"faces", "aliases", "delimiter", "default"} - config.keys()
+	if missing:
+		fail(f"missing required key(s) {', '.join(sorted(missing))}")
+
+	delimiter = config["delimiter"]
+	if not isinstance(delimiter, str) or not delimiter:
+		fail("\"delimiter\" must be a non-empty string")
+
+	# maps each symbol to its id, in order of first appearance
+	ids = {}
+	def intern(symbol, where):
+		if not isinstance(symbol, str) or not symbol:
+			fail(f"\"{where}\" must only contain non-empty strings")
+		return ids.setdefault(symbol, len(ids))
+
+	def strings(value, where):
+		if isinstance(value, str):
+			value = [value]
+		if not isinstance(value, list):
+			fail(f"\"{where}\" must be a string or a list of strings")
+		return [intern(v, where) for v in value]
+
+	# collect the faces as lists of ids until all symbols are known
+	rawfaces = config["faces"]
+	if not isinstance(rawfaces, dict) or not rawfaces:
+		fail("\"faces\" must be a non-empty object of dice")
+	facelists = {}
+	for die, faces in rawfaces.items():
+		# die names are displayed like symbols, so they get ids too
+		intern(die, "faces")
+		if not isinstance(faces, list) or not faces:
+			fail(f"the faces of \"{die}\" must be a non-empty list")
+		facelists[die] = [strings(face, "faces") for face in faces]
+
+	rawaliases = config["aliases"]
+	if not isinstance(rawaliases, dict) or rawaliases.keys() != rawfaces.keys():
+		fail("\"aliases\" must have an entry for exactly the dice in \"faces\"")
+	aliases = {}
+	die_aliases = {}
+	for die, names in rawaliases.items():
+		if not isinstance(names, list) or not names \
+		or not all(isinstance(n, str) and n for n in names):
+			fail(f"the aliases of \"{die}\" must be a non-empty list of strings")
+		for alias in names:
+			if alias.lower() in aliases:
+				fail(f"the alias \"{alias}\" is used more than once")
+			aliases[alias.lower()] = die
+		die_aliases[die] = tuple(names)
+
+	reduce = []
+	rawreduce = config.get("reduce", {})
+	if not isinstance(rawreduce, dict):
+		fail("\"reduce\" must be an object")
+	for reduce_to, reduce_from in rawreduce.items():
+		target = intern(reduce_to, "reduce")
+		reduce.extend((source, target) for source in strings(reduce_from, "reduce"))
+
+	cancels = []
+	rawcancels = config.get("cancels", [])
+	if not isinstance(rawcancels, list):
+		fail("\"cancels\" must be a list of groups")
+	for group in rawcancels:
+		group = strings(group, "cancels")
+		if len(set(group)) < 2:
+			fail("each group in \"cancels\" needs at least two different values")
+		cancels.append(tuple(group))
+
+	blanks = tuple(strings(config.get("blank", []), "blank"))
+	default = intern(config["default"], "default")
+
+	max_consecutive = config.get("max consecutive")
+	if max_consecutive is not None \
+	and (type(max_consecutive) is not int or max_consecutive < 1):
+		fail("\"max consecutive\" must be a positive integer")
+
+	# now that every symbol has an id, build the count vectors
+	faces = {}
+	for die, faceids in facelists.items():
+		vectors = []
+		for face in faceids:
+			vector = [0] * len(ids)
+			for i in face:
+				vector[i] += 1
+			vectors.append(tuple(vector))
+		faces[die] = tuple(vectors)
+
+	symbols = tuple(ids)
+	emoji = tuple(m and m.group(1) for m in map(_emoji_regex.fullmatch, symbols))
+	alternatives = "|".join(re.escape(a) for l in die_aliases.values() for a in l)
+	pattern = fr"(?:(?<=\s)|^)(\d*){re.escape(delimiter)}({alternatives})(?=\s|$)"
+
+	return Category(
+		name = name,
+		delimiter = delimiter,
+		symbols = symbols,
+		symbol_ids = MappingProxyType(ids),
+		emoji = emoji,
+		dice = tuple(rawfaces),
+		die_aliases = MappingProxyType(die_aliases),
+		aliases = MappingProxyType(aliases),
+		faces = MappingProxyType(faces),
+		reduce = tuple(reduce),
+		cancels = tuple(cancels),
+		blanks = blanks,
+		default = default,
+		max_consecutive = max_consecutive,
+		order = tuple(sorted(range(len(symbols)), key=symbols.__getitem__)),
+		pattern = pattern
+	)
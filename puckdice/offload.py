@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pipe, Process
+import asyncio
+import os
+import random
+
+class TooExpensiveError(ValueError): pass
+
+def _serve(conn):
+	"""Evaluate items sent over a connection, one at a time, until it's closed"""
+	# reseed, or every worker would roll the same numbers
+	random.seed()
+	while True:
+		try:
+			item = conn.recv()
+		except EOFError:
+			return
+		try:
+			result = (True, item.evaluate())
+		except Exception as e:
+			result = (False, e)
+		conn.send(result)
+
+class _Worker:
+	"""A process evaluating one item at a time, which can be stopped without touching any other"""
+	def __init__(self):
+		self._conn, child = Pipe()
+		self._process = Process(target=_serve, args=(child,), daemon=True)
+		self._process.start()
+		child.close()
+
+	def run(self, item):
+		"""Evaluate an item in the process, blocking until it's done"""
+		self._conn.send(item)
+		ok, value = self._conn.recv()
+		if not ok:
+			raise value
+		return value
+
+	def kill(self):
+		"""End the process, which makes a blocked run() raise EOFError, without closing the pipe"""
+		self._process.terminate()
+		self._process.join()
+
+	def close(self):
+		"""Close the pipe, once nothing is reading from it"""
+		self._conn.close()
+
+class Offloader:
+	"""
+	Evaluates Rolls and Batches by cost: cheap ones inline, expensive ones in
+	worker processes with a time limit, and the most expensive not at all.
+	Each worker runs one item at a time, so an item that runs over time is
+	stopped by ending only its own worker, leaving everyone else's rolls be.
+	"""
+	def __init__(self, inline_limit: int = 20000, max_cost: int = 2000000, timeout: float = 5.0, workers: int = None):
+		self.inline_limit = inline_limit
+		self.max_cost = max_cost
+		self.timeout = timeout
+		self._workers = workers or os.cpu_count() or 1
+		# workers waiting for something to do, started as they're first needed
+		self._idle = []
+		self._slots = None
+		# the threads waiting on workers, one per worker at most
+		self._readers = None
+
+	@staticmethod
+	def _stop(worker, reader):
+		"""End a worker, closing its pipe only once the thread reading it has let go"""
+		worker.kill()
+		def close(reader):
+			# the reader fails once the process is gone, which is expected
+			if not reader.cancelled():
+				reader.exception()
+			worker.close()
+		reader.add_done_callback(close)
+
+	async def _run(self, item):
+		if self._slots is None:
+			self._slots = asyncio.Semaphore(self._workers)
+			self._readers = ThreadPoolExecutor(self._workers)
+		async with self._slots:
+			worker = self._idle.pop() if self._idle else _Worker()
+			# waited on in a thread, so the event loop keeps running
+			reader = asyncio.wrap_future(self._readers.submit(worker.run, item))
+			try:
+				# not wait_for, which would cancel the reader rather than let it finish
+				done, _ = await asyncio.wait({reader}, timeout = self.timeout)
+			except asyncio.CancelledError:
+				# it's still working on the item, and would send back a stale result
+				self._stop(worker, reader)
+				raise
+			if not done:
+				self._stop(worker, reader)
+				raise TooExpensiveError("That roll took too long, so I gave up on it.")
+
+			try:
+				result = reader.result()
+			except (EOFError, OSError):
+				# the worker died some other way
+				self._stop(worker, reader)
+				raise TooExpensiveError("I couldn't finish that roll, please try again.")
+			except Exception:
+				# the item itself failed, which leaves the worker fine
+				self._idle.append(worker)
+				raise
+			self._idle.append(worker)
+			return result
+
+	def check(self, item):
+		"""Raise TooExpensiveError if an item costs too much to evaluate at all"""
+		if item.cost > self.max_cost:
+			raise TooExpensiveError("That's too many dice for me to roll.")
+
+	async def evaluate(self, item, inline: bool = False):
+		"""
+		Evaluate the item, returning it evaluated (possibly as a copy).
+		inline: evaluate it in this process whatever it costs, without a time limit, as when profiling
+		"""
+		self.check(item)
+		if inline or item.cost <= self.inline_limit:
+			return item.evaluate()
+		return await self._run(item)
+
+	def close(self):
+		for worker in self._idle:
+			worker.kill()
+			worker.close()
+		self._idle = []
+		if self._readers is not None:
+			self._readers.shutdown(wait = False)
@@ -0,0 +1,93 @@
+from array import array
+from math import erfc, sqrt
+
+class DieStats:
+	"""
+	Running statistics of the faces one kind of die has landed on, numbered
+	from 0. Only integer sums and a fixed-size count per face are kept, so
+	no roll history is stored and every figure is worked out in O(1).
+	"""
+	__slots__ = "low", "sides", "count", "total", "squares", "counts", "spread"
+	# dice with more sides than this only get the running sums
+	max_sides = 100
+
+	def __init__(self, low, sides:int):
+		# the number on the first face, or None if the faces aren't numbers
+		self.low = low
+		self.sides = sides
+		self.count = 0
+		# the sums of the faces rolled, and of their squares
+		self.total = 0
+		self.squares = 0
+		# how often each face came up, and the sum of those counts squared
+		self.counts = array("Q", [0]) * sides if sides <= self.max_sides else None
+		self.spread = 0
+
+	def add(self, faces:dict):
+		"""Add a {face: times rolled} mapping"""
+		for face, times in faces.items():
+			self.count += times
+			self.total += face * times
+			self.squares += face * face * times
+			if self.counts is not None:
+				old = self.counts[face]
+				self.counts[face] = old + times
+				self.spread += times * (2 * old + times)
+
+	def merge(self, other: "DieStats"):
+		"""Add in the stats of another DieStats for the same kind of die"""
+		self.count += other.count
+		self.total += other.total
+		self.squares += other.squares
+		if self.counts is not None:
+			for face, times in enumerate(other.counts):
+				self.counts[face] += times
+			self.spread = sum(c * c for c in self.counts)
+
+	@property
+	def mean(self):
+		"""The average number rolled, or None if the faces aren't numbers"""
+		if not self.count or self.low is None:
+			return None
+		return self.low + self.total / self.count
+
+	@property
+	def fair_mean(self):
+		if self.low is None:
+			return None
+		return self.low + (self.sides - 1) / 2
+
+	@property
+	def deviation(self):
+		"""The standard deviation of the numbers rolled"""
+		if not self.count or self.low is None:
+			return None
+		mean = self.total / self.count
+		return sqrt(max(self.squares / self.count - mean * mean, 0))
+
+	@property
+	def zscore(self):
+		"""How many standard errors the mean is above (or below) a fair die's"""
+		if not self.count or self.low is None or self.sides < 2:
+			return None
+		# the variance of a fair die
+		fair = (self.sides ** 2 - 1) / 12
+		return (self.mean - self.fair_mean) / sqrt(fair / self.count)
+
+	@property
+	def chi_square(self):
+		"""Pearson's chi-square statistic of the face counts against a fair die"""
+		if self.counts is None or not self.count or self.sides < 2:
+			return None
+		return max(self.sides * self.spread / self.count - self.count, 0)
+
+	@property
+	def uniformity(self):
+		"""The chance a fair die would come out at least this uneven"""
+		chi = self.chi_square
+		if chi is None:
+			return None
+		# the Wilson-Hilferty approximation of the chi-square distribution
+		k = self.sides - 1
+		z = ((chi / k) ** (1 / 3) - (1 - 2 / (9 * k))) / sqrt(2 / (9 * k))
+		return erfc(z / sqrt(2)) / 2